@@ -0,0 +1,385 @@
+import argparse
+import io
+import json
+import platform
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from functools import partial
+from typing import Any, Callable
+
+import config
+import main
+from data import object_map
+from main import Component, Entity
+
+bench_hash = "0123456789abcdef0123456789abcdef"
+
+string = "class std::basic_string<char,struct std::char_traits<char>,class std::allocator<char> >"
+vec2 = "class ceng::math::CVector2<"
+xform = "struct ceng::math::CXForm<"
+lens = "struct LensValue<"
+vector = "class std::vector<"
+
+
+def vector_of(t: str) -> str:
+	return vector + t + ",class std::allocator<" + t + " > >"
+
+
+def vector_element(t: str) -> str:
+	# up to the first comma outside of template brackets, as do_type does
+	depth = 0
+	for k, c in enumerate(t[len(vector) :]):
+		if c == "," and depth == 0:
+			return t[len(vector) : len(vector) + k]
+		elif c == "<":
+			depth += 1
+		elif c == ">":
+			depth -= 1
+	raise Exception("bad vector type: " + t)
+
+
+# (field, type, size) per synthetic component, sizes only matter for enums
+bench_components: dict[str, list[tuple[str, str, int]]] = {
+	"ScalarComponent": [
+		("enabled_flag", "bool", 1),
+		("speed", "float", 4),
+		("count", "int", 4),
+		("mask", "unsigned int", 4),
+		("weight", "double", 8),
+		("frame", "__int64", 8),
+		("uid", "unsigned __int64", 8),
+		("slot", "unsigned short", 2),
+		("name", string, 28),
+		("kind", "BenchKindEnum", 4),
+	],
+	"VectorComponent": [
+		("position", vec2 + "float>", 8),
+		("cell", vec2 + "int>", 8),
+		("floats", vector_of("float"), 16),
+		("strings", vector_of(string), 16),
+		("points", vector_of(vec2 + "float>"), 16),
+		("ids", "UintArrayInline", 16),
+	],
+	"LensComponent": [
+		("hp", lens + "int>", 12),
+		("speed", lens + "float>", 12),
+		("transform", xform + "float>", 20),
+	],
+	"TextureComponent": [
+		("texture", "special texture", 8),
+	],
+	"ObjectComponent": [
+		("explosion", "class ConfigExplosion", 400),
+		("color", "class ceng::CColorFloat", 16),
+		("damage", "class ConfigDamagesByType", 60),
+		("stains", "struct SpriteStains *", 8),
+	],
+}
+
+default_mix = (
+	"ScalarComponent=4,VectorComponent=2,LensComponent=2,"
+	"ObjectComponent=1,TextureComponent=1"
+)
+
+float_struct = struct.Struct(">f")
+
+
+def write_bench_schema(schema_path: str):
+	with open(schema_path + bench_hash + ".xml", "w") as f:
+		f.write('<Schema hash="' + bench_hash + '">\n')
+		for comp_name, fields in bench_components.items():
+			f.write('\t<Component component_name="' + comp_name + '">\n')
+			for name, t, size in fields:
+				t = t.replace("<", "&lt;").replace(">", "&gt;")
+				f.write('\t\t<Var name="' + name + '" size="' + str(size))
+				f.write('" type="' + t + '"/>\n')
+			f.write("\t</Component>\n")
+		f.write("</Schema>\n")
+
+
+class Generator:
+	def __init__(self, seed: int, texture_size: int) -> None:
+		self.random = random.Random(seed)
+		self.texture_size = texture_size
+
+	def value(self, t: str) -> Any:
+		r = self.random
+		if t == "bool":
+			return r.random() < 0.5
+		elif t == "float":
+			# rounded through float32 so a parse gives back the same value
+			return float_struct.unpack(float_struct.pack(r.uniform(-1e4, 1e4)))[0]
+		elif t == "double":
+			return r.uniform(-1e4, 1e4)
+		elif t in ("int", "int32"):
+			return r.randint(-(2**31), 2**31 - 1)
+		elif t in ("unsigned int", "uint32"):
+			return r.randint(0, 2**32 - 1)
+		elif t == "__int64":
+			return r.randint(-(2**63), 2**63 - 1)
+		elif t == "unsigned __int64":
+			return r.randint(0, 2**64 - 1)
+		elif t == "unsigned short":
+			return r.randint(0, 2**16 - 1)
+		elif t == string or t == "string":
+			return r.choice(["", "data/entities/props/barrel.xml", "bench", "hello"])
+		elif t == "special texture":
+			if r.random() < 0.3:
+				return {"special": False, "width": 0, "height": 0, "data": []}
+			w, h = r.randint(1, self.texture_size), r.randint(1, self.texture_size)
+			return {
+				"special": True,
+				"width": w,
+				"height": h,
+				"data": [r.randint(0, 2**32 - 1) for _ in range(w * h)],
+			}
+		elif t.startswith(vec2):
+			return (self.value(t[len(vec2) : -1]), self.value(t[len(vec2) : -1]))
+		elif t.startswith(lens):
+			true_type = t[len(lens) : -1]
+			return {
+				"value": self.value(true_type),
+				"default": self.value(true_type),
+				"frame": self.value("int"),
+			}
+		elif t.startswith(xform):
+			true_type = t[len(xform) : -1]
+			return {
+				"position": self.value(vec2 + true_type + ">"),
+				"scale": self.value(vec2 + true_type + ">"),
+				"rotation": self.value(true_type),
+			}
+		elif t.startswith(vector):
+			true_type = vector_element(t)
+			return [self.value(true_type) for _ in range(r.randint(0, 6))]
+		elif t == "UintArrayInline":
+			return [self.value("uint32") for _ in range(r.randint(0, 6))]
+		elif t.endswith("Enum"):
+			return r.randint(0, 15)
+		elif t == "struct SpriteStains *":
+			return None
+		elif t in object_map:
+			return {name: self.value(field_type) for name, field_type in object_map[t]}
+		raise Exception("no generator for type: " + t)
+
+	def component(self, comp_name: str) -> Component:
+		return Component(
+			comp_name,
+			self.random.choice([[""], ["enabled_in_world"], ["enabled_in_hand"]]),
+			{name: self.value(t) for name, t, _ in bench_components[comp_name]},
+			self.random.random() < 0.9,
+			b"\x00",
+		)
+
+	def entity(
+		self,
+		depth: int,
+		components: int,
+		children: int,
+		mix: dict[str, int],
+		fixed_children: bool = False,
+	) -> Entity:
+		# depth first without recursion, so a chain can be deeper than the stack
+		root = self.node(components, mix)
+		stack = [[root, depth, self.child_count(depth, children, fixed_children)]]
+		while stack:
+			top = stack[-1]  # [entity, depth, children left to make]
+			if top[2] == 0:
+				stack.pop()
+				continue
+			top[2] -= 1
+			child = self.node(components, mix)
+			top[0].children.append(child)
+			count = self.child_count(top[1] - 1, children, fixed_children)
+			stack.append([child, top[1] - 1, count])
+		return root
+
+	def child_count(self, depth: int, children: int, fixed_children: bool) -> int:
+		if depth <= 1:
+			return 0
+		return children if fixed_children else self.random.randint(0, children)
+
+	def node(self, components: int, mix: dict[str, int]) -> Entity:
+		names, weights = list(mix.keys()), list(mix.values())
+		return Entity(
+			self.random.choice(["", "bench_entity", "bench_prop"]),
+			"data/entities/bench/" + str(self.random.randint(0, 50)) + ".xml",
+			self.random.choice([[""], ["enemy"], ["enemy", "mortal"]]),
+			self.value("float"),
+			self.value("float"),
+			1.0,
+			1.0,
+			0.0,
+			[
+				self.component(comp_name)
+				for comp_name in self.random.choices(names, weights, k=components)
+			],
+			[],
+			b"\x00",
+		)
+
+
+def generate(
+	entities: int,
+	depth: int,
+	components: int,
+	children: int,
+	mix: dict[str, int],
+	seed: int = 0,
+	texture_size: int = 16,
+	fixed_children: bool = False,
+) -> list[Entity]:
+	# children is the most per entity, or the exact count with fixed_children
+	generator = Generator(seed, texture_size)
+	return [
+		generator.entity(depth, components, children, mix, fixed_children)
+		for _ in range(entities)
+	]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+	weights = {}
+	for part in mix.split(","):
+		comp_name, _, weight = part.partition("=")
+		if comp_name not in bench_components:
+			raise Exception("unknown bench component: " + comp_name)
+		weights[comp_name] = int(weight or 1)
+	return weights
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> dict[str, float]:
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		fn()
+		times.append(time.perf_counter() - start)
+	return {"min": min(times), "median": statistics.median(times), "max": max(times)}
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+	entities = generate(
+		args.entities,
+		args.depth,
+		args.components,
+		args.children,
+		parse_mix(args.mix),
+		args.seed,
+		args.texture_size,
+		args.fixed_children,
+	)
+	payload = main.save(entities, bench_hash)
+	compressed = bytes(main.compress(payload))
+	if args.keep is not None:
+		open(args.keep, "wb").write(compressed)
+	parsed = main.parse_data(compressed)
+
+	def parse():
+		reader = main.Reader(payload)
+		hash, count = main.read_header(reader)
+		list(main.parse_entities(reader, hash, count))
+
+	def export():
+		main.write_json(parsed, io.StringIO())
+
+	timings = {
+		"decompress": timed(partial(main.decompress, compressed), args.repeat),
+		"parse": timed(parse, args.repeat),
+		"parse_data": timed(partial(main.parse_data, compressed), args.repeat),
+		"parse_lazy": timed(partial(main.parse_data, compressed, True), args.repeat),
+		"save": timed(partial(main.save, parsed, bench_hash), args.repeat),
+		"compress": timed(partial(main.compress, payload), args.repeat),
+		"json": timed(export, args.repeat),
+	}
+	return {
+		"params": {
+			"entities": args.entities,
+			"depth": args.depth,
+			"components": args.components,
+			"children": args.children,
+			"fixed_children": args.fixed_children,
+			"mix": args.mix,
+			"seed": args.seed,
+			"texture_size": args.texture_size,
+			"repeat": args.repeat,
+		},
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"sizes": {
+			"compressed": len(compressed),
+			"decompressed": len(payload),
+			"entities": sum(1 for _ in iter_tree(parsed)),
+		},
+		"roundtrip": main.save(parsed, bench_hash) == payload,
+		"timings": timings,
+	}
+
+
+def iter_tree(entities: list[Entity]):
+	stack = list(entities)
+	while stack:
+		entity = stack.pop()
+		yield entity
+		stack.extend(entity.children)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description="time decompress, parse, save and json export on synthetic files"
+	)
+	parser.add_argument(
+		"-n", "--entities", type=int, default=1000, help="top level entities"
+	)
+	parser.add_argument(
+		"--depth", type=int, default=3, help="levels of entities, 1 for no children"
+	)
+	parser.add_argument(
+		"--components", type=int, default=4, help="components per entity"
+	)
+	parser.add_argument(
+		"--children", type=int, default=2, help="most children per entity"
+	)
+	parser.add_argument(
+		"--fixed-children",
+		action="store_true",
+		help="give every entity above the last level exactly --children children",
+	)
+	parser.add_argument(
+		"--chain",
+		type=int,
+		metavar="N",
+		help="top level entities are chains N deep, the same as --depth N "
+		"--children 1 --fixed-children",
+	)
+	parser.add_argument(
+		"--mix",
+		default=default_mix,
+		help="component weights, from " + ", ".join(bench_components),
+	)
+	parser.add_argument(
+		"--texture-size", type=int, default=16, help="largest special texture side"
+	)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("-r", "--repeat", type=int, default=5)
+	parser.add_argument(
+		"--keep", metavar="FILE", help="also write the generated entities file"
+	)
+	parser.add_argument("-o", "--output", help="write results to a file, not stdout")
+	args = parser.parse_args()
+	if args.chain is not None:
+		args.depth, args.children, args.fixed_children = args.chain, 1, True
+	with tempfile.TemporaryDirectory() as directory:
+		# the synthetic schema must not touch the real schema folder or cache
+		config.schema_path = directory + "/"
+		config.cache_path = directory + "/"
+		write_bench_schema(config.schema_path)
+		results = run(args)
+	if args.output is not None:
+		with open(args.output, "w") as out:
+			json.dump(results, out, indent="\t")
+	else:
+		json.dump(results, sys.stdout, indent="\t")
+		print()
@@ -4,3 +4,6 @@ if windows:
 	schema_path = "C:/Program Files (x86)/Steam/steamapps/common/Noita/data/schemas/"
 else:
 	schema_path = os.path.expanduser("~/.local/share/Steam/steamapps/common/Noita/data/schemas/")
+cache_path = "./cache/"
+dump_decompressed = False  # write every decompressed file to ./out for debugging
+dump_saved = False  # write the parsed entities back to ./saved, to check save
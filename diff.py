@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+from main import (
+	ComponentDecoders,
+	Reader,
+	component_name,
+	decompress,
+	entity_event,
+	entity_files,
+	entity_group,
+	entity_place,
+	get_decoders,
+	get_schema_data,
+	json_default,
+	name_indices,
+	pair,
+	read_header,
+	same_value,
+	skip_string,
+	transform_struct,
+)
+
+
+def digest(data: memoryview) -> bytes:
+	return hashlib.blake2b(data, digest_size=16).digest()
+
+
+@dataclass
+class ComponentHash:
+	name: str
+	digest: bytes  # of everything the component is stored as
+	fields: tuple[int, int]  # span of the fields
+
+
+@dataclass
+class EntityHash:
+	name: str
+	path: str
+	x: float
+	y: float
+	digest: bytes  # of the whole subtree, which is stored contiguously
+	header: bytes  # digest of name, path, tags and transform
+	components: list[ComponentHash] = field(default_factory=list)
+	children: list["EntityHash"] = field(default_factory=list)
+
+
+@dataclass
+class HashedFile:
+	data: bytes
+	decoders: ComponentDecoders
+	entities: list[EntityHash]
+
+
+def hash_entities(
+	reader: Reader, decoders: ComponentDecoders, maybe_num_entities: int
+) -> list[EntityHash]:
+	# components are skipped, not decoded, only their spans are hashed
+	data = reader.data
+	roots: list[EntityHash] = []
+	stack: list[list] = []  # [entity, start, children left to read]
+	left = maybe_num_entities
+	while True:
+		while stack and stack[-1][2] == 0:
+			entity, start, _ = stack.pop()
+			entity.digest = digest(data[start : reader.ptr])
+		if stack:
+			stack[-1][2] -= 1
+		elif left == 0:
+			break
+		else:
+			left -= 1
+		start = reader.ptr
+		name = reader.read_string()
+		reader.ptr += 1  # deleted
+		path = reader.read_string()
+		skip_string(reader)  # tags
+		x, y = reader.read_struct(transform_struct)[:2]
+		entity = EntityHash(name, path, x, y, b"", digest(data[start : reader.ptr]))
+		for _ in range(reader.read_be(4)):
+			component_start = reader.ptr
+			component_name = reader.read_string()
+			reader.ptr += 2  # deleted, enabled
+			skip_string(reader)  # tags
+			fields_start = reader.ptr
+			decoders[component_name].skip(reader)
+			entity.components.append(
+				ComponentHash(
+					component_name,
+					digest(data[component_start : reader.ptr]),
+					(fields_start, reader.ptr),
+				)
+			)
+		if stack:
+			stack[-1][0].children.append(entity)
+		else:
+			roots.append(entity)
+		stack.append([entity, start, reader.read_be(4)])
+	return roots
+
+
+def hash_file(compressed_data: bytes) -> HashedFile:
+	# a copy, as the decompression buffer is reused by the next file
+	data = bytes(decompress(compressed_data))
+	reader = Reader(data)
+	hash, maybe_num_entities = read_header(reader)
+	type_sizes, component_data = get_schema_data(hash)
+	decoders = get_decoders(hash, type_sizes, component_data)
+	return HashedFile(data, decoders, hash_entities(reader, decoders, maybe_num_entities))
+
+
+def component_digest(component: ComponentHash) -> bytes:
+	return component.digest
+
+
+def entity_digest(entity: EntityHash) -> bytes:
+	return entity.digest
+
+
+def diff_entities(
+	old_file: HashedFile,
+	new_file: HashedFile,
+	old: list[EntityHash],
+	new: list[EntityHash],
+	file: str,
+) -> Iterator[dict[str, Any]]:
+	# same pairing and events as watch in main.py, identical subtrees are paired
+	# first and skipped by digest instead of compared
+	stack = [(old, new, "")]
+	while stack:
+		old, new, prefix = stack.pop()
+		for i, j in pair(old, new, [entity_digest, entity_place], entity_group):
+			if j is None:
+				entity = old[i]  # type: ignore
+				locator = prefix + str(i)
+				yield entity_event(file, locator, entity, "removed", x=entity.x, y=entity.y)
+				continue
+			entity = new[j]
+			locator = prefix + str(j)
+			if i is None:
+				yield entity_event(file, locator, entity, "added", x=entity.x, y=entity.y)
+				continue
+			old_entity = old[i]
+			if old_entity.digest == entity.digest:
+				continue  # the whole subtree is the same
+			if old_entity.header != entity.header:
+				if not same_value((old_entity.x, old_entity.y), (entity.x, entity.y)):
+					yield entity_event(
+						file,
+						locator,
+						entity,
+						"moved",
+						old=(old_entity.x, old_entity.y),
+						new=(entity.x, entity.y),
+					)
+				else:
+					yield entity_event(file, locator, entity, "header changed")
+			yield from diff_components(old_file, new_file, old_entity, entity, file, locator)
+			stack.append((old_entity.children, entity.children, locator + "/"))
+
+
+def diff_components(
+	old_file: HashedFile,
+	new_file: HashedFile,
+	old_entity: EntityHash,
+	entity: EntityHash,
+	file: str,
+	locator: str,
+) -> Iterator[dict[str, Any]]:
+	old, new = old_entity.components, entity.components
+	old_indices, new_indices = name_indices(old), name_indices(new)
+	for i, j in pair(old, new, [component_digest], component_name):
+		if j is None:
+			yield entity_event(
+				file,
+				locator,
+				entity,
+				"component removed",
+				component=old[i].name,  # type: ignore
+				component_index=old_indices[i],  # type: ignore
+			)
+			continue
+		component = new[j]
+		where = {"component": component.name, "component_index": new_indices[j]}
+		if i is None:
+			fields = read_fields(new_file, component)
+			yield entity_event(
+				file, locator, entity, "component added", **where, fields=fields
+			)
+			continue
+		old_component = old[i]
+		if old_component.digest == component.digest:
+			continue
+		old_fields = read_fields(old_file, old_component)
+		fields = read_fields(new_file, component)
+		changed = False
+		for name, value in fields.items():
+			old_value = old_fields.get(name)
+			if not same_value(old_value, value):
+				changed = True
+				yield entity_event(
+					file,
+					locator,
+					entity,
+					"field changed",
+					**where,
+					field=name,
+					old=old_value,
+					new=value,
+				)
+		if not changed:
+			# tags, enabled or deleted
+			yield entity_event(file, locator, entity, "component changed", **where)
+
+
+def read_fields(hashed: HashedFile, component: ComponentHash) -> dict[str, Any]:
+	return hashed.decoders[component.name].read(
+		Reader(hashed.data, component.fields[0])
+	)
+
+
+def diff_files(old_file: str | None, new_file: str | None) -> Iterator[dict[str, Any]]:
+	name = os.path.basename(new_file or old_file or "")
+	if old_file is None or new_file is None:
+		yield {"file": name, "event": "file added" if old_file is None else "file removed"}
+		return
+	old_data, new_data = open(old_file, "rb").read(), open(new_file, "rb").read()
+	if old_data == new_data:
+		return
+	old = hash_file(old_data)
+	new = hash_file(new_data)
+	yield from diff_entities(old, new, old.entities, new.entities, name)
+
+
+def diff_paths(old_path: str, new_path: str) -> Iterator[dict[str, Any]]:
+	# two entity files, or two world directories with files paired by name
+	if not os.path.isdir(old_path):
+		yield from diff_files(old_path, new_path)
+		return
+	old_files = {os.path.basename(file): file for file in entity_files(old_path)}
+	new_files = {os.path.basename(file): file for file in entity_files(new_path)}
+	for name in sorted(old_files.keys() | new_files.keys()):
+		try:
+			yield from diff_files(old_files.get(name), new_files.get(name))
+		except Exception as e:
+			raise Exception("Error in file " + name) from e
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(
+		description="print what changed between two saves as json lines"
+	)
+	parser.add_argument("old", help="entities_*.bin file or world directory")
+	parser.add_argument("new", help="entities_*.bin file or world directory")
+	args = parser.parse_args()
+	for delta in diff_paths(args.old, args.new):
+		sys.stdout.write(json.dumps(delta, default=json_default) + "\n")
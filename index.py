@@ -0,0 +1,253 @@
+import argparse
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Iterator
+
+from main import (
+	Entity,
+	entity_files,
+	parse_file,
+	parse_file_flat,
+	unflatten_entities,
+)
+
+schema_sql = """
+PRAGMA foreign_keys = ON;
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	name TEXT UNIQUE NOT NULL,
+	size INTEGER NOT NULL,
+	mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entities (
+	id INTEGER PRIMARY KEY,
+	file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	parent_id INTEGER REFERENCES entities(id) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	path TEXT NOT NULL,
+	tags TEXT NOT NULL,
+	x REAL,
+	y REAL,
+	size_x REAL,
+	size_y REAL,
+	rotation REAL
+);
+CREATE TABLE IF NOT EXISTS entity_tags (
+	entity_id INTEGER NOT NULL REFERENCES entities(id) ON DELETE CASCADE,
+	tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS components (
+	id INTEGER PRIMARY KEY,
+	entity_id INTEGER NOT NULL REFERENCES entities(id) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	tags TEXT NOT NULL,
+	enabled INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS component_tags (
+	component_id INTEGER NOT NULL REFERENCES components(id) ON DELETE CASCADE,
+	tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fields (
+	component_id INTEGER NOT NULL REFERENCES components(id) ON DELETE CASCADE,
+	name TEXT NOT NULL,
+	value
+);
+CREATE INDEX IF NOT EXISTS entities_file ON entities(file_id);
+CREATE INDEX IF NOT EXISTS entities_parent ON entities(parent_id);
+CREATE INDEX IF NOT EXISTS entities_path ON entities(path);
+CREATE INDEX IF NOT EXISTS entities_position ON entities(x, y);
+CREATE INDEX IF NOT EXISTS entity_tags_tag ON entity_tags(tag, entity_id);
+CREATE INDEX IF NOT EXISTS entity_tags_entity ON entity_tags(entity_id);
+CREATE INDEX IF NOT EXISTS components_entity ON components(entity_id);
+CREATE INDEX IF NOT EXISTS components_name ON components(name);
+CREATE INDEX IF NOT EXISTS component_tags_tag ON component_tags(tag, component_id);
+CREATE INDEX IF NOT EXISTS component_tags_component ON component_tags(component_id);
+CREATE INDEX IF NOT EXISTS fields_component ON fields(component_id);
+CREATE INDEX IF NOT EXISTS fields_name_value ON fields(name, value);
+"""
+
+drop_sql = """
+DROP TABLE IF EXISTS fields;
+DROP TABLE IF EXISTS component_tags;
+DROP TABLE IF EXISTS components;
+DROP TABLE IF EXISTS entity_tags;
+DROP TABLE IF EXISTS entities;
+DROP TABLE IF EXISTS files;
+"""
+schema_version = 1  # bump when schema_sql changes
+
+scalar_types = (bool, int, float, str)
+sqlite_int_max = (1 << 63) - 1
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+	db = sqlite3.connect(db_path)
+	if db.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+		# the index only mirrors the files, an older layout is rebuilt from scratch
+		db.executescript(drop_sql)
+		db.execute("PRAGMA user_version = " + str(schema_version))
+	db.executescript(schema_sql)
+	return db
+
+
+def next_id(db: sqlite3.Connection, table: str) -> int:
+	return db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM " + table).fetchone()[0]
+
+
+def walk(entities: list[Entity]) -> Iterator[tuple[Entity, Entity | None]]:
+	# (entity, parent) depth first, without recursion
+	stack: list[tuple[Entity, Entity | None]] = [(e, None) for e in reversed(entities)]
+	while stack:
+		entity, parent = stack.pop()
+		yield entity, parent
+		stack.extend((child, entity) for child in reversed(entity.children))
+
+
+def insert_file(
+	db: sqlite3.Connection,
+	file: str,
+	entities: list[Entity],
+	field_names: set[str] | None = None,
+	stat: os.stat_result | None = None,
+):
+	# field_names=None indexes every scalar field
+	# stat should be taken before the file was parsed, so a file rewritten since
+	# looks changed on the next update
+	if stat is None:
+		stat = os.stat(file)
+	name = os.path.basename(file)
+	db.execute("DELETE FROM files WHERE name = ?", (name,))
+	file_id = db.execute(
+		"INSERT INTO files (name, size, mtime) VALUES (?, ?, ?)",
+		(name, stat.st_size, stat.st_mtime_ns),
+	).lastrowid
+	entity_id = next_id(db, "entities")
+	component_id = next_id(db, "components")
+	entity_rows = []
+	entity_tag_rows = []
+	component_rows = []
+	component_tag_rows = []
+	field_rows: list[tuple[int, str, Any]] = []
+	ids: dict[int, int] = {}  # id(entity) -> row id
+	for entity, parent in walk(entities):
+		ids[id(entity)] = entity_id
+		# sqlite stores nan as NULL, so the transform columns allow it
+		entity_rows.append(
+			(
+				entity_id,
+				file_id,
+				None if parent is None else ids[id(parent)],
+				entity.name,
+				entity.path,
+				",".join(entity.tags),
+				entity.x,
+				entity.y,
+				entity.size_x,
+				entity.size_y,
+				entity.rotation,
+			)
+		)
+		entity_tag_rows += [(entity_id, tag) for tag in entity.tags if tag != ""]
+		for component in entity.components:
+			component_rows.append(
+				(
+					component_id,
+					entity_id,
+					component.name,
+					",".join(component.tags),
+					component.enabled,
+				)
+			)
+			component_tag_rows += [
+				(component_id, tag) for tag in component.tags if tag != ""
+			]
+			for field, value in component.fields.items():
+				if field_names is not None and field not in field_names:
+					continue
+				if isinstance(value, scalar_types):
+					if isinstance(value, int) and value > sqlite_int_max:
+						value = str(value)  # uint64 fields
+					field_rows.append((component_id, field, value))
+			component_id += 1
+		entity_id += 1
+	db.executemany(
+		"INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entity_rows
+	)
+	db.executemany("INSERT INTO entity_tags VALUES (?, ?)", entity_tag_rows)
+	db.executemany("INSERT INTO components VALUES (?, ?, ?, ?, ?)", component_rows)
+	db.executemany("INSERT INTO component_tags VALUES (?, ?)", component_tag_rows)
+	db.executemany("INSERT INTO fields VALUES (?, ?, ?)", field_rows)
+
+
+def changed_files(
+	db: sqlite3.Connection, files: list[str]
+) -> dict[str, os.stat_result]:
+	known = {
+		name: (size, mtime)
+		for name, size, mtime in db.execute("SELECT name, size, mtime FROM files")
+	}
+	changed = {}
+	for file in files:
+		stat = os.stat(file)
+		if known.get(os.path.basename(file)) != (stat.st_size, stat.st_mtime_ns):
+			changed[file] = stat
+	return changed
+
+
+def update_index(
+	db_path: str,
+	path: str,
+	jobs: int = 1,
+	field_names: set[str] | None = None,
+) -> list[str]:
+	# only files whose size or mtime changed are parsed again, returns those files
+	files = entity_files(path)
+	with connect(db_path) as db:
+		names = {os.path.basename(file) for file in files}
+		for (name,) in db.execute("SELECT name FROM files").fetchall():
+			if name not in names:
+				db.execute("DELETE FROM files WHERE name = ?", (name,))
+		changed = changed_files(db, files)
+		with ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as executor:
+			if executor is not None:
+				# sent back flat, deep trees are too deep to pickle as they are
+				results = map(unflatten_entities, executor.map(parse_file_flat, changed))
+			else:
+				results = map(parse_file, changed)
+			for file, stat in changed.items():
+				try:
+					entities = next(results)
+				except Exception as e:
+					raise Exception("Error in file " + os.path.basename(file)) from e
+				insert_file(db, file, entities, field_names, stat)
+	db.close()
+	return list(changed)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("db", help="sqlite database to create or update")
+	parser.add_argument("path", nargs="?", help="world directory to index")
+	parser.add_argument("-j", "--jobs", type=int, default=1)
+	parser.add_argument(
+		"--field",
+		action="append",
+		help="only index these component fields (default: every scalar field)",
+	)
+	parser.add_argument("--sql", help="run a query against the index and print it")
+	args = parser.parse_args()
+	if args.path is not None:
+		changed = update_index(
+			args.db,
+			args.path,
+			args.jobs,
+			None if args.field is None else set(args.field),
+		)
+		print("indexed " + str(len(changed)) + " changed files", file=sys.stderr)
+	if args.sql is not None:
+		with connect(args.db) as db:
+			for row in db.execute(args.sql):
+				print("\t".join(str(v) for v in row))
@@ -1,74 +1,163 @@
+import argparse
+import asyncio
 import ctypes
+import fnmatch
+import hashlib
+import html
 import json
+import mmap
 import os
+import pickle
 import re
 import struct
 import sys
-import xml.dom.minidom
-from dataclasses import dataclass
-from typing import Any
-from xml.dom.minidom import parseString
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, TextIO, TypeVar
 
 import config
 from data import object_map
 
+T = TypeVar("T")
+
+enum_formats = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
 fastlz = ctypes.cdll.LoadLibrary("./fastlz.dll" if config.windows else "./fastlz.so")
+fastlz.fastlz_decompress.restype = ctypes.c_int32
+fastlz.fastlz_decompress.argtypes = [
+	ctypes.c_void_p,
+	ctypes.c_int32,
+	ctypes.c_void_p,
+	ctypes.c_int32,
+]
+fastlz.fastlz_compress.restype = ctypes.c_int32
+fastlz.fastlz_compress.argtypes = [ctypes.c_void_p, ctypes.c_int32, ctypes.c_void_p]
+
+
+be_structs = {size: struct.Struct(">" + fmt) for size, fmt in enum_formats.items()}
+le_structs = {size: struct.Struct("<" + fmt) for size, fmt in enum_formats.items()}
+float_struct = struct.Struct(">f")
+uint32_struct = be_structs[4]
 
 
 class Reader:
-	def __init__(self, data: bytes) -> None:
-		self.data = data
-		self.ptr = 0
+	def __init__(self, data: bytes | bytearray | memoryview, ptr: int = 0) -> None:
+		self.data = memoryview(data)
+		if self.data.format != "B":
+			self.data = self.data.cast("B")
+		self.ptr = ptr
 
 	def read_le(self, count: int) -> int:
-		val = 0
-		self.ptr += count - 1
-		for _ in range(count):
-			val *= 0x100
-			val += self.data[self.ptr]
-			self.ptr -= 1
-		self.ptr += count + 1
-		return val
+		layout = le_structs.get(count)
+		if layout is None:
+			return int.from_bytes(self.read_bytes(count), "little")
+		v = layout.unpack_from(self.data, self.ptr)[0]
+		self.ptr += count
+		return v
 
 	def read_be(self, count: int) -> int:
-		val = 0
-		for _ in range(count):
-			val *= 0x100
-			val += self.data[self.ptr]
-			self.ptr += 1
-		return val
+		layout = be_structs.get(count)
+		if layout is None:
+			return int.from_bytes(self.read_bytes(count), "big")
+		v = layout.unpack_from(self.data, self.ptr)[0]
+		self.ptr += count
+		return v
 
 	def read_float(self) -> float:
-		return struct.unpack("f", self.read_bytes(4)[::-1])[0]
+		return self.read_struct(float_struct)[0]
+
+	def read_struct(self, layout: struct.Struct) -> tuple:
+		v = layout.unpack_from(self.data, self.ptr)
+		self.ptr += layout.size
+		return v
+
+	def read_be_array(self, count: int) -> tuple[int, ...]:
+		# count big endian uint32s
+		v = struct.unpack_from(">%dI" % count, self.data, self.ptr)
+		self.ptr += 4 * count
+		return v
+
+	def read_view(self, count: int) -> memoryview:
+		# no copy, only valid as long as the underlying buffer is
+		if self.ptr + count > len(self.data):
+			raise IndexError("read past end of data at " + hex(self.ptr))
+		v = self.data[self.ptr : self.ptr + count]
+		self.ptr += count
+		return v
+
+	def read_string(self) -> str:
+		# uint32 length followed by that many bytes
+		start = self.ptr + 4
+		end = start + uint32_struct.unpack_from(self.data, self.ptr)[0]
+		if end > len(self.data):
+			raise IndexError("read past end of data at " + hex(start))
+		self.ptr = end
+		# lossless for any bytes, write_string encodes them back the same way
+		return str(self.data[start:end], "utf-8", "surrogateescape")
 
 	def assertion(self, count: int, value: bytes, message: str):
 		if self.read_bytes(count) != value:
 			raise Exception(message)
 
 	def read_null_term(self) -> bytes:
-		val = b""
-		while True:
-			x = self.data[self.ptr]
-			self.ptr += 1
-			if x == 0x00:
-				return val
-			val += bytes([x])
+		end = self.ptr
+		while self.data[end] != 0x00:
+			end += 1
+		val = self.read_bytes(end - self.ptr)
+		self.ptr += 1
+		return val
 
 	def read_bool(self) -> bool:
-		v = self.read_bytes(1)
-		if v[0] > 1:
+		v = self.data[self.ptr]
+		self.ptr += 1
+		if v > 1:
 			raise Exception("invalid bool")
-		return v == b"\x01"
+		return v == 1
 
 	def mystery(self, count: int, message: str):
 		print(message, self.read_bytes(count))
 
 	def read_bytes(self, count: int) -> bytes:
-		v = self.data[self.ptr : self.ptr + count]
+		if self.ptr + count > len(self.data):
+			raise IndexError("read past end of data at " + hex(self.ptr))
+		v = bytes(self.data[self.ptr : self.ptr + count])
 		self.ptr += count
 		return v
 
 
+class Writer:
+	def __init__(self) -> None:
+		self.data = bytearray()
+
+	def write_be(self, count: int, value: int):
+		layout = be_structs.get(count)
+		if layout is None:
+			self.data += value.to_bytes(count, "big")
+		else:
+			self.data += layout.pack(value)
+
+	def write_struct(self, layout: struct.Struct, *values: Any):
+		self.data += layout.pack(*values)
+
+	def write_be_array(self, values: list[int] | tuple[int, ...]):
+		# big endian uint32s, without a length
+		self.data += struct.pack(">%dI" % len(values), *values)
+
+	def write_string(self, value: str):
+		encoded = value.encode("utf-8", "surrogateescape")
+		self.data += uint32_struct.pack(len(encoded))
+		self.data += encoded
+
+	def write_bytes(self, value: bytes):
+		self.data += value
+
+
 class ComponentFieldData:
 	typename: str
 	field: str
@@ -77,16 +166,29 @@ class ComponentFieldData:
 ComponentData = dict[str, list[ComponentFieldData]]
 
 
-@dataclass
+@dataclass(slots=True)
 class Component:
 	name: str
 	tags: list[str]
 	fields: dict[str, Any]
 	enabled: bool
 	not_deleted_maybe: bytes
+	# lazy components only: the buffer, span of the fields and their decoder
+	source: tuple[memoryview, int, int, Callable[[Reader], dict[str, Any]]] | None = (
+		field(default=None, repr=False, compare=False)
+	)
 
+	def __getattr__(self, name: str) -> Any:
+		# lazily parsed components have no fields attribute until it is first used
+		if name != "fields" or self.source is None:
+			raise AttributeError(name)
+		data, start, _, read = self.source
+		self.fields = read(Reader(data, start))
+		self.source = None
+		return self.fields
 
-@dataclass
+
+@dataclass(slots=True)
 class Entity:
 	name: str
 	path: str
@@ -101,27 +203,32 @@ class Entity:
 	deleted_maybe: bytes
 
 
-def parse_entity(reader: Reader, type_sizes, component_data, child_counts):
-	name_len = reader.read_be(4)
-	name = bstr(reader.read_bytes(name_len))
+transform_struct = struct.Struct(">5f")
+
+
+def split_tags(tags: str) -> list[str]:
+	return [sys.intern(tag) for tag in tags.split(",")]
+
+
+def parse_entity(
+	reader: Reader, type_sizes, component_data, decoders=None, lazy=False
+) -> tuple[Entity, int]:
+	# names, paths and tags repeat across the whole world, share one copy of each
+	name = sys.intern(reader.read_string())
 	deleted_maybe = reader.read_bytes(1)  # 0x00
-	path_len = reader.read_be(4)
-	path = bstr(reader.read_bytes(path_len))
-	tag_len = reader.read_be(4)
-	tag = bstr(reader.read_bytes(tag_len)).split(",")
-	x = reader.read_float()
-	y = reader.read_float()
-	scale_x = reader.read_float()
-	scale_y = reader.read_float()
-	rotation = reader.read_float()
+	path = sys.intern(reader.read_string())
+	tag = split_tags(reader.read_string())
+	x, y, scale_x, scale_y, rotation = reader.read_struct(transform_struct)
 	maybe_num_comps = reader.read_be(4)
 	entity = Entity(
 		name, path, tag, x, y, scale_x, scale_y, rotation, [], [], deleted_maybe
 	)
 	for _ in range(maybe_num_comps):
-		entity.components.append(parse_component(reader, type_sizes, component_data))
-	child_counts.append(reader.read_be(4))
-	return entity
+		entity.components.append(
+			parse_component(reader, type_sizes, component_data, decoders, lazy)
+		)
+	child_count = reader.read_be(4)
+	return entity, child_count
 
 
 def bstr(a: bytes) -> str:
@@ -141,175 +248,749 @@ trivial_types: dict[str, tuple[int, str]] = {
 	"bool": (1, "b"),
 }
 
+trivial_structs = {t: struct.Struct(">" + pair[1]) for t, pair in trivial_types.items()}
 
-def do_type(reader: Reader, t: str, type_sizes, component_data) -> Any:
-	vec2 = "class ceng::math::CVector2<"
-	xform = "struct ceng::math::CXForm<"
-	lens = "struct LensValue<"
-	vector = "class std::vector<"
-	string = "class std::basic_string<char,struct std::char_traits<char>,class std::allocator<char> >"
-	if t == "bool":  # for errors
-		data = reader.read_bool()
+
+vec2_prefix = "class ceng::math::CVector2<"
+xform_prefix = "struct ceng::math::CXForm<"
+lens_prefix = "struct LensValue<"
+vector_prefix = "class std::vector<"
+string_type = "class std::basic_string<char,struct std::char_traits<char>,class std::allocator<char> >"
+
+
+@dataclass(frozen=True)
+class TypeInfo:
+	# a type name parsed once, shared by the reader, the writer and compile_type
+	kind: str
+	name: str
+	args: tuple["TypeInfo", ...] = ()  # element types, or object fields
+	keys: tuple[str, ...] = ()  # object field names
+	layout: struct.Struct | None = None  # trivial types
+
+
+def vector_element(t: str) -> str:
+	# up to the first comma outside of template brackets
+	partial_type = t[len(vector_prefix) :]
+	count = 0
+	for k, c in enumerate(partial_type):
+		if c == "," and count == 0:
+			return partial_type[:k]
+		elif c == "<":
+			count += 1
+		elif c == ">":
+			count -= 1
+	return ""
+
+
+def parse_type_name(t: str) -> TypeInfo:
+	if t == "bool":
+		return TypeInfo("bool", t)
 	elif t in trivial_types.keys():
-		pair = trivial_types[t]
-		data = struct.unpack(pair[1], reader.read_bytes(pair[0])[::-1])[0]
+		return TypeInfo("trivial", t, layout=trivial_structs[t])
 	elif t == "special texture":
-		is_special = do_type(reader, "bool", type_sizes, component_data)
-		if not is_special:
-			return {"special": False, "data": [[]]}
-		(w, h) = do_type(reader, vec2 + "int>", type_sizes, component_data)
-		data = {
-			"special": True,
-			"data": [
-				[
-					do_type(reader, "uint32", type_sizes, component_data)
-					for x in range(w)
-				]
-				for y in range(h)
-			],
-		}  # material id arr?
-
-	elif t[: len(vec2)] == vec2:
-		true_type = t[len(vec2) : -1]
-		data = (
-			do_type(reader, true_type, type_sizes, component_data),
-			do_type(reader, true_type, type_sizes, component_data),
+		return TypeInfo("special texture", t)
+	elif t[: len(vec2_prefix)] == vec2_prefix:
+		return TypeInfo("vec2", t, (describe_type(t[len(vec2_prefix) : -1]),))
+	elif t[: len(lens_prefix)] == lens_prefix:
+		true_type = describe_type(t[len(lens_prefix) : -1])
+		return TypeInfo(
+			"lens",
+			t,
+			(true_type, true_type, describe_type("int")),
+			("value", "default", "frame"),
 		)
-	elif t[: len(lens)] == lens:
-		true_type = t[len(lens) : -1]
-
-		data = {
-			"value": do_type(reader, true_type, type_sizes, component_data),
-			"default": do_type(reader, true_type, type_sizes, component_data),
-			"frame": do_type(reader, "int", type_sizes, component_data),
-		}
-		# data = {
-		# 	"later": do_type(reader, true_type, type_sizes, component_data),
-		# 	"earlier": do_type(reader, true_type, type_sizes, component_data),
-		# 	"frame": do_type(reader, "int", type_sizes, component_data),
-		# }
-	elif t[: len(xform)] == xform:
-		true_type = t[len(xform) : -1]
-		data = {
-			"position": do_type(
-				reader, vec2 + true_type + ">", type_sizes, component_data
-			),
-			"scale": do_type(
-				reader, vec2 + true_type + ">", type_sizes, component_data
-			),
-			"rotation": do_type(reader, true_type, type_sizes, component_data),
-		}
-	elif t[: len(vector)] == vector:
-		partial_type = t[len(vector) :]
-		true_type = ""
-		count = 0
-		for k, c in enumerate(partial_type):
-			if c == "," and count == 0:
-				true_type = partial_type[:k]
-			elif c == "<":
-				count += 1
-			elif c == ">":
-				count -= 1
-		data = [
-			do_type(reader, true_type, type_sizes, component_data)
-			for _ in range(reader.read_be(4))
-		]
-	elif t == string or t == "string":
-		size = reader.read_be(4)
-		data = bstr(reader.read_bytes(size))
+	elif t[: len(xform_prefix)] == xform_prefix:
+		true_type = t[len(xform_prefix) : -1]
+		vec2_type = describe_type(vec2_prefix + true_type + ">")
+		return TypeInfo(
+			"xform",
+			t,
+			(vec2_type, vec2_type, describe_type(true_type)),
+			("position", "scale", "rotation"),
+		)
+	elif t[: len(vector_prefix)] == vector_prefix:
+		return TypeInfo("vector", t, (describe_type(vector_element(t)),))
+	elif t == string_type or t == "string":
+		return TypeInfo("string", t)
 	elif t == "UintArrayInline" or t == "struct UintArrayInline":
-		size = reader.read_be(4)
-		data = [reader.read_be(4) for _ in range(size)]
+		return TypeInfo("uint array", t)
 	elif t[-4:] == "Enum":
-		data = reader.read_be(type_sizes[t])
+		return TypeInfo("enum", t)  # the size comes from the schema
 	elif t == "struct SpriteStains *":
-		data = None
+		return TypeInfo("none", t)
+	elif t in object_map.keys():
+		return TypeInfo(
+			"object",
+			t,
+			tuple(describe_type(field[1]) for field in object_map[t]),
+			tuple(field[0] for field in object_map[t]),
+		)
+	return TypeInfo("unknown", t)
+
+
+type_infos: dict[str, TypeInfo] = {}
+
+
+def describe_type(t: str) -> TypeInfo:
+	info = type_infos.get(t)
+	if info is None:
+		info = parse_type_name(t)
+		type_infos[t] = info
+	return info
+
+
+def read_value(reader: Reader, info: TypeInfo, type_sizes: dict[str, int]) -> Any:
+	kind = info.kind
+	if kind == "trivial":
+		return reader.read_struct(info.layout)[0]  # type: ignore
+	elif kind == "bool":  # for errors
+		return reader.read_bool()
+	elif kind == "string":
+		return reader.read_string()
+	elif kind == "vec2":
+		true_type = info.args[0]
+		return (
+			read_value(reader, true_type, type_sizes),
+			read_value(reader, true_type, type_sizes),
+		)
+	elif kind == "lens" or kind == "xform" or kind == "object":
+		# lens is stored as value, default, frame. maybe later, earlier, frame?
+		return {
+			key: read_value(reader, arg, type_sizes)
+			for key, arg in zip(info.keys, info.args)
+		}
+	elif kind == "vector":
+		true_type = info.args[0]
+		return [
+			read_value(reader, true_type, type_sizes) for _ in range(reader.read_be(4))
+		]
+	elif kind == "uint array":
+		return read_uint_array(reader)
+	elif kind == "enum":
+		return reader.read_be(type_sizes[info.name])
+	elif kind == "special texture":
+		return read_special_texture(reader)
+	elif kind == "none":
+		return None
+	raise Exception("unknown type: " + info.name + " at " + hex(reader.ptr))
+
+
+def write_value(
+	writer: "Writer", info: TypeInfo, value: Any, type_sizes: dict[str, int]
+):
+	kind = info.kind
+	if kind == "trivial" or kind == "bool":
+		writer.write_struct(trivial_structs[info.name], value)
+	elif kind == "string":
+		writer.write_string(value)
+	elif kind == "vec2":
+		true_type = info.args[0]
+		write_value(writer, true_type, value[0], type_sizes)
+		write_value(writer, true_type, value[1], type_sizes)
+	elif kind == "lens" or kind == "xform" or kind == "object":
+		for key, arg in zip(info.keys, info.args):
+			write_value(writer, arg, value[key], type_sizes)
+	elif kind == "vector":
+		true_type = info.args[0]
+		writer.write_be(4, len(value))
+		for v in value:
+			write_value(writer, true_type, v, type_sizes)
+	elif kind == "uint array":
+		write_uint_array(writer, value)
+	elif kind == "enum":
+		writer.write_be(type_sizes[info.name], value)
+	elif kind == "special texture":
+		write_special_texture(writer, value)
+	elif kind == "none":
+		pass
 	else:
-		if t in object_map.keys():
-			component_object = {}
-			for field in object_map[t]:
-				component_object[field[0]] = do_type(
-					reader, field[1], type_sizes, component_data
-				)
-			return component_object
+		raise Exception("unknown type: " + info.name)
+
+
+def do_type(reader: Reader, t: str, type_sizes, component_data) -> Any:
+	return read_value(reader, describe_type(t), type_sizes)
+
+
+@dataclass
+class FixedLayout:
+	fmt: str  # big endian struct format, without the byte order prefix
+	count: int  # number of values fmt unpacks to
+	build: Callable[[tuple], Any] | None  # None means the single value is used as is
+	flatten: Callable[[Any], Any] | None = None  # inverse of build
+
+	@property
+	def size(self) -> int:
+		return struct.calcsize(">" + self.fmt)
+
+
+@dataclass
+class VariableLayout:
+	read: Callable[[Reader], Any]
+	skip: Callable[[Reader], None]  # moves past the value without building it
+	write: Callable[["Writer", Any], None]
+
+
+TypeDecoder = FixedLayout | VariableLayout
+
+
+def build_bool(values: tuple) -> bool:
+	if values[0] > 1:
+		raise Exception("invalid bool")
+	return values[0] == 1
+
+
+def compile_sequence(
+	parts: list[TypeDecoder], keys: list[str] | None = None
+) -> TypeDecoder:
+	# keys=None builds a tuple, otherwise a dict with the given keys
+	if keys is None:
+		combine: Callable[[Any], Any] = tuple
+		items: Callable[[Any], Any] = lambda value: value  # noqa: E731
+	else:
+		combine = lambda values: dict(zip(keys, values))  # noqa: E731
+		items = lambda value: [value[key] for key in keys]  # noqa: E731
+
+	if all(isinstance(part, FixedLayout) for part in parts):
+		layouts: list[FixedLayout] = parts  # type: ignore
+		fmt = "".join(part.fmt for part in layouts)
+		count = sum(part.count for part in layouts)
+		if count == len(layouts) and all(part.build is None for part in layouts):
+			return FixedLayout(fmt, count, combine, items)
+
+		def build(values: tuple) -> Any:
+			out = []
+			i = 0
+			for part in layouts:
+				if part.build is None:
+					out.append(values[i])
+				else:
+					out.append(part.build(values[i : i + part.count]))
+				i += part.count
+			return combine(out)
+
+		def flatten(value: Any) -> list:
+			out = []
+			for part, item in zip(layouts, items(value)):
+				if part.flatten is None:
+					out.append(item)
+				else:
+					out.extend(part.flatten(item))
+			return out
+
+		return FixedLayout(fmt, count, build, flatten)
+
+	if keys is None:
+		fields = compile_fields(list(enumerate(parts)))
+		return VariableLayout(
+			lambda reader: tuple(fields.read(reader).values()),
+			fields.skip,
+			fields.write,  # tuples are indexed like the enumerate keys
+		)
+	return compile_fields(list(zip(keys, parts)))
+
+
+def skip_string(reader: Reader):
+	reader.ptr += 4 + uint32_struct.unpack_from(reader.data, reader.ptr)[0]
+
+
+def write_string(writer: "Writer", value: str):
+	writer.write_string(value)
+
+
+def read_uint_array(reader: Reader) -> list[int]:
+	return list(reader.read_be_array(reader.read_be(4)))
+
+
+def skip_uint_array(reader: Reader):
+	size = reader.read_be(4)
+	reader.ptr += 4 * size
+
+
+def write_uint_array(writer: "Writer", value: list[int]):
+	writer.write_be(4, len(value))
+	writer.write_be_array(value)
+
+
+texture_size_struct = struct.Struct(">ii")
+# array typecode holding exactly 32 bits
+uint32_typecode = "I" if array("I").itemsize == 4 else "L"
+
+
+def read_special_texture(reader: Reader) -> dict[str, Any]:
+	# pixels are row major, width * height material ids?
+	if not reader.read_bool():
+		return {
+			"special": False,
+			"width": 0,
+			"height": 0,
+			"data": array(uint32_typecode),
+		}
+	w, h = reader.read_struct(texture_size_struct)
+	w, h = max(w, 0), max(h, 0)
+	data = array(uint32_typecode)
+	data.frombytes(reader.read_view(4 * w * h))
+	if sys.byteorder == "little":
+		data.byteswap()
+	return {"special": True, "width": w, "height": h, "data": data}
+
+
+def skip_special_texture(reader: Reader):
+	if reader.read_bool():
+		w, h = reader.read_struct(texture_size_struct)
+		reader.ptr += 4 * max(w, 0) * max(h, 0)
+
+
+def write_special_texture(writer: "Writer", value: dict[str, Any]):
+	if not value["special"]:
+		writer.write_bytes(b"\x00")
+		return
+	writer.write_bytes(b"\x01")
+	writer.write_struct(texture_size_struct, value["width"], value["height"])
+	data = array(uint32_typecode, value["data"])
+	if len(data) != value["width"] * value["height"]:
+		raise Exception("special texture data does not match its size")
+	if sys.byteorder == "little":
+		data.byteswap()
+	writer.write_bytes(data.tobytes())
+
+
+def compile_vector(element: TypeDecoder) -> VariableLayout:
+	if isinstance(element, VariableLayout):
+		read, skip = element.read, element.skip
+
+		def read_vector(reader: Reader) -> list:
+			return [read(reader) for _ in range(reader.read_be(4))]
+
+		def skip_vector(reader: Reader):
+			for _ in range(reader.read_be(4)):
+				skip(reader)
+
+		write = element.write
+
+		def write_vector(writer: Writer, value: list):
+			writer.write_be(4, len(value))
+			for item in value:
+				write(writer, item)
+
+		return VariableLayout(read_vector, skip_vector, write_vector)
+
+	fmt, count, build, size = element.fmt, element.count, element.build, element.size
+	flatten = element.flatten
+
+	element_struct = struct.Struct(">" + fmt)
+
+	def read_fixed_vector(reader: Reader) -> list:
+		n = reader.read_be(4)
+		# a garbage count must fail before anything of its size is built
+		if n * max(size, 1) > len(reader.data) - reader.ptr:
+			raise IndexError("vector past end of data at " + hex(reader.ptr))
+		if count == 0:
+			return [build(()) for _ in range(n)]  # type: ignore
+		view = reader.read_view(n * size)
+		if count == 1 and build is None:
+			return list(struct.unpack(">%d%s" % (n, fmt), view))
+		if build is None:
+			return [v for values in element_struct.iter_unpack(view) for v in values]
+		return [build(values) for values in element_struct.iter_unpack(view)]
+
+	def skip_fixed_vector(reader: Reader):
+		n = reader.read_be(4)
+		reader.ptr += size * n
+
+	def write_fixed_vector(writer: Writer, value: list):
+		writer.write_be(4, len(value))
+		if count == 0:
+			return
+		if flatten is None:
+			values = value
+		else:
+			values = [v for item in value for v in flatten(item)]
+		if count == 1:
+			writer.write_struct(struct.Struct(">%d%s" % (len(values), fmt)), *values)
+			return
+		pack = element_struct.pack
+		writer.data += b"".join(
+			pack(*values[i : i + count]) for i in range(0, len(values), count)
+		)
+
+	return VariableLayout(read_fixed_vector, skip_fixed_vector, write_fixed_vector)
+
+
+def compile_type(t: str, decoders: "ComponentDecoders") -> TypeDecoder:
+	info = describe_type(t)
+	kind = info.kind
+	if kind == "bool":
+		return FixedLayout("B", 1, build_bool)
+	elif kind == "trivial":
+		return FixedLayout(trivial_types[t][1], 1, None)
+	elif kind == "special texture":
+		return VariableLayout(
+			read_special_texture, skip_special_texture, write_special_texture
+		)
+	elif kind == "vec2":
+		true_type = decoders.type(info.args[0].name)
+		return compile_sequence([true_type, true_type])
+	elif kind == "lens" or kind == "xform" or kind == "object":
+		return compile_sequence(
+			[decoders.type(arg.name) for arg in info.args], list(info.keys)
+		)
+	elif kind == "vector":
+		return compile_vector(decoders.type(info.args[0].name))
+	elif kind == "string":
+		return VariableLayout(Reader.read_string, skip_string, write_string)
+	elif kind == "uint array":
+		return VariableLayout(read_uint_array, skip_uint_array, write_uint_array)
+	elif kind == "enum":
+		size = decoders.type_sizes.get(t)
+		if size in enum_formats.keys():
+			return FixedLayout(enum_formats[size], 1, None)
+
+		def skip_enum(reader: Reader):
+			reader.ptr += decoders.type_sizes[t]
+
+		return VariableLayout(
+			lambda reader: reader.read_be(decoders.type_sizes[t]),
+			skip_enum,
+			lambda writer, value: writer.write_be(decoders.type_sizes[t], value),
+		)
+	elif kind == "none":
+		return FixedLayout("", 0, lambda values: None, lambda value: ())
+
+	def unknown(reader: Reader) -> Any:
 		raise Exception("unknown type: " + t + " at " + hex(reader.ptr))
-	return data
+
+	def unknown_write(writer: Writer, value: Any):
+		raise Exception("unknown type: " + t)
+
+	return VariableLayout(unknown, unknown, unknown_write)
+
+
+def compile_fields(fields: list[tuple[Any, TypeDecoder]]) -> VariableLayout:
+	# consecutive fixed size fields are merged into a single struct read
+	steps: list[tuple[struct.Struct | None, list]] = []
+	skips: list[int | Callable[[Reader], None]] = []
+	run_fmt = ""
+	writes: list[tuple[struct.Struct | None, list]] = []
+	run: list[tuple[Any, int, int, Callable[[tuple], Any] | None]] = []
+	run_flatten: list[tuple[Any, Callable[[Any], Any] | None]] = []
+	run_count = 0
+
+	def end_run():
+		layout = struct.Struct(">" + run_fmt)
+		steps.append((layout, run))
+		skips.append(layout.size)
+		writes.append((layout, run_flatten))
+
+	for key, decoder in fields:
+		if isinstance(decoder, FixedLayout):
+			run.append((key, run_count, run_count + decoder.count, decoder.build))
+			run_flatten.append((key, decoder.flatten))
+			run_fmt += decoder.fmt
+			run_count += decoder.count
+			continue
+		if run:
+			end_run()
+			run_fmt, run, run_flatten, run_count = "", [], [], 0
+		steps.append((None, [(key, decoder.read)]))
+		skips.append(decoder.skip)
+		writes.append((None, [(key, decoder.write)]))
+	if run:
+		end_run()
+
+	def decode(reader: Reader) -> dict[Any, Any]:
+		data = {}
+		for layout, entries in steps:
+			if layout is None:
+				key, read = entries[0]
+				data[key] = read(reader)
+				continue
+			values = reader.read_struct(layout)
+			for key, start, stop, build in entries:
+				if build is None:
+					data[key] = values[start]
+				else:
+					data[key] = build(values[start:stop])
+		return data
+
+	def skip(reader: Reader):
+		for step in skips:
+			if isinstance(step, int):
+				reader.ptr += step
+			else:
+				step(reader)
+
+	def write(writer: Writer, data: Any):
+		for layout, entries in writes:
+			if layout is None:
+				key, write_value = entries[0]
+				write_value(writer, data[key])
+				continue
+			values = []
+			for key, flatten in entries:
+				if flatten is None:
+					values.append(data[key])
+				else:
+					values.extend(flatten(data[key]))
+			writer.write_struct(layout, *values)
+
+	return VariableLayout(decode, skip, write)
+
+
+def compile_component(
+	fields: list[ComponentFieldData], decoders: "ComponentDecoders"
+) -> VariableLayout:
+	return compile_fields(
+		[(field.field, decoders.type(field.typename)) for field in fields]
+	)
+
+
+class ComponentDecoders(dict[str, VariableLayout]):
+	# components are compiled on first use, so unused ones with unknown types don't fail
+	def __init__(self, type_sizes: dict[str, int], component_data: ComponentData):
+		super().__init__()
+		self.type_sizes = type_sizes
+		self.component_data = component_data
+		self.types: dict[str, TypeDecoder] = {}
+
+	def __missing__(self, component_name: str) -> VariableLayout:
+		decoder = compile_component(self.component_data[component_name], self)
+		self[component_name] = decoder
+		return decoder
+
+	def type(self, t: str) -> TypeDecoder:
+		if t not in self.types:
+			decoder = compile_type(t, self)
+			if profile is not None:
+				decoder = profile.wrap_layout(t, decoder)
+			self.types[t] = decoder
+		return self.types[t]
+
+
+schema_decoders: dict[bytes, ComponentDecoders] = {}
+profile: "DecodeProfile | None" = None  # set by enable_profiling
+
+
+def get_decoders(
+	hash: bytes, type_sizes: dict[str, int], component_data: ComponentData
+) -> ComponentDecoders:
+	if hash not in schema_decoders.keys():
+		schema_decoders[hash] = ComponentDecoders(type_sizes, component_data)
+	return schema_decoders[hash]
 
 
 def parse_component(
-	reader: Reader, type_sizes: dict[str, int], component_data: ComponentData
+	reader: Reader,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+	decoders: ComponentDecoders | None = None,
+	lazy: bool = False,
 ) -> Component:
-	component_name_len = reader.read_be(4)
-	component_name = bstr(reader.read_bytes(component_name_len))
+	# lazy needs decoders and a reader over a buffer that outlives the parse
+	component_name = sys.intern(reader.read_string())
 	deleted = reader.read_bytes(1)  # first is ??? second is enabled
 	enabled = reader.read_bool()
-	component_tag_len = reader.read_be(4)
-	component_tags = bstr(reader.read_bytes(component_tag_len))
-	fields = component_data[component_name]
-	data = {}
-	for field in fields:
-		# print(field.field, field.typename, hex(reader.ptr), end=" ")
-		data[field.field] = do_type(reader, field.typename, type_sizes, component_data)
-		# print(data[field.field])
-	comp = Component(component_name, component_tags.split(","), data, enabled, deleted)
-	return comp
+	component_tags = reader.read_string()
+	if lazy and decoders is not None:
+		start = reader.ptr
+		decoder = decoders[component_name]
+		decoder.skip(reader)
+		comp = Component(
+			component_name,
+			split_tags(component_tags),
+			{},
+			enabled,
+			deleted,
+			(reader.data, start, reader.ptr, decoder.read),
+		)
+		del comp.fields  # decoded by __getattr__ on first access
+		return comp
+	if decoders is not None:
+		data = decoders[component_name].read(reader)
+	else:
+		data = {}
+		for field in component_data[component_name]:
+			# print(field.field, field.typename, hex(reader.ptr), end=" ")
+			data[field.field] = do_type(
+				reader, field.typename, type_sizes, component_data
+			)
+			# print(data[field.field])
+	return Component(component_name, split_tags(component_tags), data, enabled, deleted)
 
 
-def get_schema_data(hash):
+schema_token_re = re.compile(
+	r"<!--.*?-->|<[?!][^>]*>"
+	r"|<(/?)([^\s/>]+)((?:[^>\"'/]|\"[^\"]*\"|'[^']*'|/(?!>))*)(/?)>"
+	r"|(<)",  # anything else starting with < is a tag that never ends
+	re.S,
+)
+schema_attribute_re = re.compile(r"""([^\s=]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+
+def read_schema_xml(schema_file: str) -> tuple[dict[str, int], ComponentData]:
+	# one pass over the tags, attribute values may hold unescaped < and > in types
+	# the root's children are components and their children are fields
 	type_sizes: dict[str, int] = {}
 	component_data: ComponentData = {}
-	if hash != b"":
-		schema_content = open(
-			config.schema_path + str(hash)[2:-1] + ".xml",
-			"r",
-		).read()
-
-		def fix(s):
-			os = s
-			s = re.sub(r'("[^\n]*)>([^\n]*")', r"\1&gt;\2", s)
-			s = re.sub(r'("[^\n]*)<([^\n]*")', r"\1&lt;\2", s)
-			if s == os:
-				return s
-			return fix(s)
-
-		schema_content = fix(schema_content)
-		tree = parseString(schema_content)
-		for i in tree.documentElement.childNodes:
-			if not isinstance(i, xml.dom.minidom.Element):
-				continue
-			comp_name = i.getAttribute("component_name")
-			v: list[ComponentFieldData] = []
-			component_data[comp_name] = v
-			for child in i.childNodes:
-				if not isinstance(child, xml.dom.minidom.Element):
-					continue
-				var_name = child.getAttribute("name")
-				var_size = int(child.getAttribute("size"))
-				var_type = child.getAttribute("type")
+	schema_content = open(schema_file, "r").read()
+	depth = 0
+	v: list[ComponentFieldData] = []
+	for tag in schema_token_re.finditer(schema_content):
+		closing, name, attributes, self_closing, unterminated = tag.groups()
+		if unterminated:
+			line = schema_content.count("\n", 0, tag.start()) + 1
+			raise Exception("Unterminated tag in " + schema_file + " line " + str(line))
+		if name is None:
+			continue  # comment, declaration or processing instruction
+		if closing:
+			depth -= 1
+			continue
+		if depth == 1 or depth == 2:
+			# findall gives "" for the quote style that didn't match
+			values = {
+				key: html.unescape(double or single)
+				for key, double, single in schema_attribute_re.findall(attributes)
+			}
+			if depth == 1:
+				v = []
+				component_data[values.get("component_name", "")] = v
+			else:
 				data = ComponentFieldData()
-				data.typename = var_type
-				data.field = var_name
+				data.typename = values.get("type", "")
+				data.field = values.get("name", "")
 				v.append(data)
-				type_sizes[var_type] = var_size
+				type_sizes[data.typename] = int(values.get("size", ""))
+		if not self_closing:
+			depth += 1
 	return type_sizes, component_data
 
 
-def parse_data(compressed_data: bytes) -> list[Entity]:
-	compressed_reader = Reader(compressed_data)
-	compressed_size, decompressed_size = compressed_reader.read_le(
-		4
-	), compressed_reader.read_le(4)
-	input_buffer = ctypes.create_string_buffer(
-		compressed_data[compressed_reader.ptr :], compressed_size
-	)
-	output_buffer = ctypes.create_string_buffer(decompressed_size)
-	fastlz.fastlz_decompress.restype = ctypes.c_int32
-	fastlz.fastlz_decompress(
-		input_buffer, compressed_size, output_buffer, decompressed_size
-	)
-	decompressed = b"".join([x for x in output_buffer])
-	open("./out", "wb").write(decompressed)
-	data_reader = Reader(decompressed)
+def load_schema_cache(cache_file: str, mtime: int):
+	try:
+		cached = json.load(open(cache_file, "r"))
+	except (OSError, ValueError):
+		return None
+	if cached.get("mtime") != mtime:
+		return None
+	component_data: ComponentData = {}
+	for comp_name, fields in cached["components"].items():
+		v: list[ComponentFieldData] = []
+		component_data[comp_name] = v
+		for var_name, var_type in fields:
+			data = ComponentFieldData()
+			data.typename = var_type
+			data.field = var_name
+			v.append(data)
+	return cached["type_sizes"], component_data
+
+
+def write_schema_cache(
+	cache_file: str,
+	mtime: int,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+):
+	cached = {
+		"mtime": mtime,
+		"type_sizes": type_sizes,
+		"components": {
+			comp_name: [[field.field, field.typename] for field in fields]
+			for comp_name, fields in component_data.items()
+		},
+	}
+	try:
+		os.makedirs(config.cache_path, exist_ok=True)
+		# written then renamed so concurrent runs never see a partial file
+		tmp_file = cache_file + "." + str(os.getpid()) + ".tmp"
+		open(tmp_file, "w").write(json.dumps(cached))
+		os.replace(tmp_file, cache_file)
+	except OSError:
+		pass  # the cache is only an optimisation
+
+
+schema_cache: dict[bytes, tuple[dict[str, int], ComponentData]] = {}
+
+
+def get_schema_data(hash):
+	if hash in schema_cache.keys():
+		return schema_cache[hash]
+	type_sizes: dict[str, int] = {}
+	component_data: ComponentData = {}
+	if hash != b"":
+		schema_file = config.schema_path + str(hash)[2:-1] + ".xml"
+		cache_file = config.cache_path + str(hash)[2:-1] + ".json"
+		mtime = os.stat(schema_file).st_mtime_ns
+		cached = load_schema_cache(cache_file, mtime)
+		if cached is not None:
+			type_sizes, component_data = cached
+		else:
+			type_sizes, component_data = read_schema_xml(schema_file)
+			write_schema_cache(cache_file, mtime, type_sizes, component_data)
+	schema_cache[hash] = (type_sizes, component_data)
+	return type_sizes, component_data
+
+
+def buffer_address(data: bytes | bytearray | mmap.mmap, offset: int = 0) -> int:
+	# from_buffer needs a writable buffer, so mmaps must be opened with ACCESS_COPY
+	if isinstance(data, bytes):
+		return ctypes.cast(data, ctypes.c_void_p).value + offset  # type: ignore
+	return ctypes.addressof(ctypes.c_char.from_buffer(data, offset))
+
+
+compress_buffer = bytearray()
+
+
+def compress(data: bytes | bytearray) -> memoryview:
+	# the inverse of decompress, including the 8 byte size header
+	# the returned view points into a shared buffer and is only valid until the next call
+	global compress_buffer
+	# fastlz needs 5% headroom and at least 66 bytes
+	size = 8 + max(66, len(data) + len(data) // 20 + 1)
+	if len(compress_buffer) < size:
+		compress_buffer = bytearray(size)
+	compressed_size = 0
+	if len(data) != 0:
+		compressed_size = fastlz.fastlz_compress(
+			buffer_address(data), len(data), buffer_address(compress_buffer, 8)
+		)
+	struct.pack_into("<II", compress_buffer, 0, compressed_size, len(data))
+	return memoryview(compress_buffer)[: 8 + compressed_size]
+
+
+decompress_buffer = bytearray()
+
+
+def decompress(compressed_data: bytes | bytearray) -> memoryview:
+	# the returned view points into a shared buffer and is only valid until the next call
+	global decompress_buffer
+	decompressed_size = struct.unpack_from("<I", compressed_data, 4)[0]
+	if len(decompress_buffer) < decompressed_size:
+		decompress_buffer = bytearray(decompressed_size)
+	return decompress_into(compressed_data, decompress_buffer)
+
+
+def decompress_into(
+	compressed_data: bytes | bytearray | mmap.mmap, buffer: bytearray
+) -> memoryview:
+	# buffer must already be large enough
+	compressed_size, decompressed_size = struct.unpack_from("<II", compressed_data)
+	if len(compressed_data) < 8 + compressed_size:
+		raise Exception("truncated file")
+	if decompressed_size != 0:
+		size = fastlz.fastlz_decompress(
+			buffer_address(compressed_data, 8),
+			compressed_size,
+			buffer_address(buffer),
+			decompressed_size,
+		)
+		if size != decompressed_size:
+			raise Exception("decompression failed")
+	decompressed = memoryview(buffer)[:decompressed_size]
+	if config.dump_decompressed:
+		open("./out", "wb").write(decompressed)
+	return decompressed
+
+
+def read_header(data_reader: Reader) -> tuple[bytes, int]:
 	empty = data_reader.read_bytes(4)
 	if empty == b"\x00\x02\x00\x20":
 		pass  # empty file
@@ -321,201 +1002,1356 @@ def parse_data(compressed_data: bytes) -> list[Entity]:
 	hash_size = data_reader.read_be(4)  # size info
 	# hash size is 0x20 if not empty
 	hash = data_reader.read_bytes(hash_size)
-	type_sizes, component_data = get_schema_data(hash)
-
 	maybe_num_entities = data_reader.read_be(4)
+	return hash, maybe_num_entities
 
-	root = Entity("root", "??", [], 0, 0, 1, 1, 0, [], [], b"")
-	child_counts = [maybe_num_entities]
-	entities = [root]
-	i = 0
-	while i < sum(child_counts):
-		e = parse_entity(data_reader, type_sizes, component_data, child_counts)
-		entities.append(e)
-		i = i + 1
-
-	def adjust(a):
-		return {"name": a.name, "children": [adjust(c) for c in a.children]}
 
-	def handle(data: list[tuple[Entity, int]]) -> Entity:
-		v = data.pop(0)
-		for _ in range(v[1]):
-			v[0].children.append(handle(data))
-		return v[0]
+def parse_entities(
+	data_reader: Reader, hash: bytes, maybe_num_entities: int, lazy: bool = False
+) -> Iterator[Entity]:
+	type_sizes, component_data = get_schema_data(hash)
+	decoders = get_decoders(hash, type_sizes, component_data)
 
-	parented = handle(list(zip(entities, child_counts)))
-	return parented.children
+	for _ in range(maybe_num_entities):
+		entity, child_count = parse_entity(
+			data_reader, type_sizes, component_data, decoders, lazy
+		)
+		parse_children(
+			data_reader, entity, child_count, type_sizes, component_data, decoders, lazy
+		)
+		yield entity
 
 
-def save_type(
-	t: str, value: Any, type_sizes: dict[str, int], component_data: ComponentData
-) -> bytes:
-	data = b""
-	vec2 = "class ceng::math::CVector2<"
-	xform = "struct ceng::math::CXForm<"
-	lens = "struct LensValue<"
-	vector = "class std::vector<"
-	string = "class std::basic_string<char,struct std::char_traits<char>,class std::allocator<char> >"
-	if t in trivial_types.keys():
-		data = struct.pack(trivial_types[t][1], value)[::-1]
-	elif t == "special texture":
-		if not value["special"]:
-			return b"\x00"
-		data = b"\x01"
-		data += save_type(
-			"int", len(value["data"]), type_sizes, component_data
-		) + save_type("int", len(value["data"][0]), type_sizes, component_data)
-		data += b"".join(
-			[
-				b"".join(
-					[save_type("uint32", y, type_sizes, component_data) for y in x]
-				)
-				for x in value["data"]
-			]
+def parse_children(
+	reader: Reader,
+	entity: Entity,
+	child_count: int,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+	decoders: ComponentDecoders,
+	lazy: bool = False,
+):
+	# entities are stored depth first, each followed by its children
+	stack = [[entity, child_count]]  # [parent, children left to read]
+	while stack:
+		top = stack[-1]
+		if top[1] == 0:
+			stack.pop()
+			continue
+		top[1] -= 1
+		child, child_count = parse_entity(
+			reader, type_sizes, component_data, decoders, lazy
 		)
-	elif t[: len(vec2)] == vec2:
-		true_type = t[len(vec2) : -1]
-		data = save_type(true_type, value[0], type_sizes, component_data) + save_type(
-			true_type, value[1], type_sizes, component_data
-		)
-	elif t[: len(lens)] == lens:
-		true_type = t[len(lens) : -1]
-		data = (
-			save_type(true_type, value["value"], type_sizes, component_data)
-			+ save_type(true_type, value["default"], type_sizes, component_data)
-			+ save_type("int", value["frame"], type_sizes, component_data)
+		top[0].children.append(child)
+		stack.append([child, child_count])
+
+
+@dataclass
+class EntityFilter:
+	# an entity matches if it passes every option that is set
+	path_glob: str | None = None
+	tags: list[str] = field(default_factory=list)  # all of them are needed
+	bbox: tuple[float, float, float, float] | None = None  # x0, y0, x1, y1
+
+	def __post_init__(self) -> None:
+		self.path_re = (
+			None
+			if self.path_glob is None
+			else re.compile(fnmatch.translate(self.path_glob))
 		)
-	elif t[: len(xform)] == xform:
-		true_type = t[len(xform) : -1]
-		data = (
-			save_type(
-				vec2 + true_type + ">", value["position"], type_sizes, component_data
+
+	def matches(self, path: str, tags: list[str], x: float, y: float) -> bool:
+		if self.path_re is not None and self.path_re.match(path) is None:
+			return False
+		if self.bbox is not None:
+			x0, y0, x1, y1 = self.bbox
+			if not (x0 <= x <= x1 and y0 <= y <= y1):
+				return False
+		return all(tag in tags for tag in self.tags)
+
+	def select(self, entities: Iterable[Entity]) -> Iterator[Entity]:
+		# the highest matching entities with their whole subtree, the same result
+		# parse_filtered_entities gives for already parsed entities
+		stack = list(reversed(list(entities)))
+		while stack:
+			entity = stack.pop()
+			if self.matches(entity.path, entity.tags, entity.x, entity.y):
+				yield entity
+			else:
+				stack.extend(reversed(entity.children))
+
+
+def read_entity_header(reader: Reader) -> tuple[str, list[str], float, float]:
+	# path, tags and position, leaves the reader at the component count
+	skip_string(reader)  # name
+	reader.ptr += 1  # deleted
+	path = reader.read_string()
+	tags = reader.read_string().split(",")
+	x, y = reader.read_struct(transform_struct)[:2]
+	return path, tags, x, y
+
+
+def skip_components(reader: Reader, decoders: ComponentDecoders):
+	for _ in range(reader.read_be(4)):
+		component_name = reader.read_string()
+		reader.ptr += 2  # deleted, enabled
+		skip_string(reader)  # tags
+		decoders[component_name].skip(reader)
+
+
+def parse_filtered_entities(
+	data_reader: Reader,
+	hash: bytes,
+	maybe_num_entities: int,
+	entity_filter: EntityFilter,
+	lazy: bool = False,
+) -> Iterator[Entity]:
+	# yields every entity that matches and has no matching ancestor, with its whole
+	# subtree. entities that don't match only have their header decoded, the
+	# components are skipped and their children are checked in turn
+	type_sizes, component_data = get_schema_data(hash)
+	decoders = get_decoders(hash, type_sizes, component_data)
+	stack = [maybe_num_entities]  # entities left to read below each skipped parent
+	while stack:
+		if stack[-1] == 0:
+			stack.pop()
+			continue
+		stack[-1] -= 1
+		start = data_reader.ptr
+		if entity_filter.matches(*read_entity_header(data_reader)):
+			data_reader.ptr = start
+			entity, child_count = parse_entity(
+				data_reader, type_sizes, component_data, decoders, lazy
 			)
-			+ save_type(
-				vec2 + true_type + ">", value["scale"], type_sizes, component_data
+			parse_children(
+				data_reader,
+				entity,
+				child_count,
+				type_sizes,
+				component_data,
+				decoders,
+				lazy,
 			)
-			+ save_type(true_type, value["rotation"], type_sizes, component_data)
+			yield entity
+			continue
+		skip_components(data_reader, decoders)
+		stack.append(data_reader.read_be(4))
+
+
+class BufferPool:
+	# decompression buffers shared between the read threads and the parser
+	def __init__(self) -> None:
+		self.buffers: list[bytearray] = []
+		self.lock = threading.Lock()
+
+	def get(self, size: int) -> bytearray:
+		with self.lock:
+			for i, buffer in enumerate(self.buffers):
+				if len(buffer) >= size:
+					return self.buffers.pop(i)
+		return bytearray(size)
+
+	def put(self, buffer: bytearray):
+		with self.lock:
+			self.buffers.append(buffer)
+
+
+generator_buffers = BufferPool()  # iter_parse takes one per open generator
+
+
+def iter_parse(
+	compressed_data: bytes,
+	lazy: bool = False,
+	entity_filter: EntityFilter | None = None,
+) -> Iterator[Entity]:
+	# yields each top level entity once its whole subtree has been read
+	# each generator holds its own buffer, so several files can be iterated at once
+	buffer = generator_buffers.get(struct.unpack_from("<I", compressed_data, 4)[0])
+	try:
+		yield from parse_decompressed(
+			decompress_into(compressed_data, buffer), lazy, entity_filter
 		)
-	elif t[: len(vector)] == vector:
-		partial_type = t[len(vector) :]
-		true_type = ""
-		count = 0
-		for k, c in enumerate(partial_type):
-			if c == "," and count == 0:
-				true_type = partial_type[:k]
-			elif c == "<":
-				count += 1
-			elif c == ">":
-				count -= 1
-		data = save_type("int", len(value), type_sizes, component_data)
-		for v in value:
-			data += save_type(true_type, v, type_sizes, component_data)
-	elif t == string or t == "string":
-		data = save_type("int", len(value), type_sizes, component_data) + value.encode()
-	elif t == "UintArrayInline" or t == "struct UintArrayInline":
-		data = save_type("int", len(value), type_sizes, component_data)
-		for v in value:
-			data += save_type("uint32", v, type_sizes, component_data)
-	elif t[-4:] == "Enum":
-		data = save_type("uint32", value, type_sizes, component_data)
-	elif t == "struct SpriteStains *":
-		pass
+	finally:
+		generator_buffers.put(buffer)
+
+
+def parse_decompressed(
+	decompressed: memoryview,
+	lazy: bool = False,
+	entity_filter: EntityFilter | None = None,
+) -> Iterator[Entity]:
+	# lazy components keep their own copy of the file and decode fields on first use
+	data_reader = Reader(bytes(decompressed) if lazy else decompressed)
+	hash, maybe_num_entities = read_header(data_reader)
+	if entity_filter is not None:
+		yield from parse_filtered_entities(
+			data_reader, hash, maybe_num_entities, entity_filter, lazy
+		)
+		return
+	yield from parse_entities(data_reader, hash, maybe_num_entities, lazy)
+
+
+def parse_data(
+	compressed_data: bytes,
+	lazy: bool = False,
+	entity_filter: EntityFilter | None = None,
+) -> list[Entity]:
+	return list(iter_parse(compressed_data, lazy, entity_filter))
+
+
+def load_file(file: str) -> tuple[str, list[Entity]]:
+	# the schema hash is needed to save the entities back
+	data_reader = Reader(decompress(open(file, "rb").read()))
+	hash, maybe_num_entities = read_header(data_reader)
+	return bstr(hash), list(parse_entities(data_reader, hash, maybe_num_entities))
+
+
+def file_schema_hash(file: str) -> str:
+	hash, _ = read_header(Reader(decompress(open(file, "rb").read())))
+	return bstr(hash)
+
+
+def entity_files(path: str) -> list[str]:
+	if not os.path.isdir(path):
+		return [path]
+	# sorted, so the merged output does not depend on the filesystem's order
+	return sorted(
+		os.path.join(path, file) for file in os.listdir(path) if "entities" in file
+	)
+
+
+def parse_file(file: str, entity_filter: EntityFilter | None = None) -> list[Entity]:
+	return parse_data(open(file, "rb").read(), entity_filter=entity_filter)
+
+
+FlatEntities = list[tuple[Entity, int]]
+
+
+def flatten_entities(entities: list[Entity]) -> FlatEntities:
+	# (entity without its children, child count) depth first, deep trees are too
+	# deep to pickle as they are
+	flat: FlatEntities = []
+	stack = list(reversed(entities))
+	while stack:
+		entity = stack.pop()
+		flat.append((replace(entity, children=[]), len(entity.children)))
+		stack.extend(reversed(entity.children))
+	return flat
+
+
+def unflatten_entities(flat: FlatEntities) -> list[Entity]:
+	roots: list[Entity] = []
+	stack: list[list] = []  # [parent, children left to add], as in parse_children
+	for entity, child_count in flat:
+		while stack and stack[-1][1] == 0:
+			stack.pop()
+		if stack:
+			stack[-1][1] -= 1
+			stack[-1][0].children.append(entity)
+		else:
+			roots.append(entity)
+		stack.append([entity, child_count])
+	return roots
+
+
+def parse_file_flat(
+	file: str, entity_filter: EntityFilter | None = None
+) -> FlatEntities:
+	# for worker processes, the result is sent back flat
+	return flatten_entities(parse_file(file, entity_filter))
+
+
+def flat_result(future: Future) -> list[Entity]:
+	return unflatten_entities(future.result())
+
+
+def read_compressed(file: str, use_mmap: bool = False) -> bytes | mmap.mmap:
+	with open(file, "rb") as f:
+		if use_mmap and os.fstat(f.fileno()).st_size != 0:
+			return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+		return f.read()
+
+
+def load_decompressed(
+	file: str, pool: BufferPool, use_mmap: bool = False
+) -> tuple[bytearray, memoryview]:
+	# runs on a read thread, fastlz releases the gil while it works
+	compressed_data = read_compressed(file, use_mmap)
+	try:
+		buffer = pool.get(struct.unpack_from("<I", compressed_data, 4)[0])
+		try:
+			return buffer, decompress_into(compressed_data, buffer)
+		except Exception:
+			pool.put(buffer)
+			raise
+	finally:
+		if isinstance(compressed_data, mmap.mmap):
+			compressed_data.close()
+
+
+def prefetch_files(
+	files: list[str], pool: BufferPool, read_ahead: int = 2, use_mmap: bool = False
+) -> Iterator[Future]:
+	# files are read and decompressed on threads, at most read_ahead ahead of
+	# whoever consumes the futures, which come back in order
+	with ThreadPoolExecutor(read_ahead) as executor:
+		pending: deque[Future] = deque()
+		for file in files:
+			pending.append(executor.submit(load_decompressed, file, pool, use_mmap))
+			if len(pending) > read_ahead:
+				yield pending.popleft()
+		while pending:
+			yield pending.popleft()
+
+
+def parse_prefetched(
+	prefetched: Iterator[Future],
+	pool: BufferPool,
+	entity_filter: EntityFilter | None = None,
+) -> list[Entity]:
+	buffer, decompressed = next(prefetched).result()
+	try:
+		return list(parse_decompressed(decompressed, entity_filter=entity_filter))
+	finally:
+		pool.put(buffer)
+
+
+def file_digest(file: str) -> str:
+	return hashlib.blake2b(open(file, "rb").read(), digest_size=16).hexdigest()
+
+
+pickle_format = 5  # bump when Entity or Component change shape
+
+
+class ParseManifest:
+	# size, mtime and content hash of every file of a directory run, next to a
+	# pickle of its parse result, so unchanged files are not parsed again
+	def __init__(self, directory: str) -> None:
+		key = hashlib.md5(os.path.abspath(directory).encode()).hexdigest()
+		self.path = config.cache_path + "scans/" + key + "-" + str(pickle_format) + "/"
+		self.entries: dict[str, dict[str, Any]] = {}
+		self.pending: dict[str, tuple[os.stat_result, str]] = {}  # changed files
+		try:
+			self.entries = json.load(open(self.path + "manifest.json", "r"))
+		except (OSError, ValueError):
+			pass
+
+	def cached(self, file: str) -> str | None:
+		# digest of a stored result that is still valid for file, otherwise the
+		# stat and digest are kept for store, taken before the file is parsed
+		name = os.path.basename(file)
+		stat = os.stat(file)
+		entry = self.entries.get(name)
+		if entry is not None and not os.path.exists(self.path + entry["hash"] + ".pickle"):
+			entry = None
+		if entry is not None and entry["size"] == stat.st_size:
+			if entry["mtime"] == stat.st_mtime_ns:
+				return entry["hash"]
+		# touched but maybe not changed, the hash decides
+		digest = file_digest(file)
+		if entry is None or digest != entry["hash"]:
+			self.pending[name] = (stat, digest)
+			return None
+		entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime_ns
+		return digest
+
+	def load(self, digest: str) -> list[Entity]:
+		return unflatten_entities(pickle.load(open(self.path + digest + ".pickle", "rb")))
+
+	def store(self, file: str, entities: list[Entity]):
+		# only for files cached returned None for
+		name = os.path.basename(file)
+		stat, digest = self.pending.pop(name)
+		os.makedirs(self.path, exist_ok=True)
+		tmp_file = self.path + digest + ".pickle." + str(os.getpid()) + ".tmp"
+		with open(tmp_file, "wb") as f:
+			pickle.dump(flatten_entities(entities), f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_file, self.path + digest + ".pickle")
+		self.entries[name] = {
+			"size": stat.st_size,
+			"mtime": stat.st_mtime_ns,
+			"hash": digest,
+		}
+
+	def save(self, files: list[str]):
+		names = {os.path.basename(file) for file in files}
+		self.entries = {k: v for k, v in self.entries.items() if k in names}
+		os.makedirs(self.path, exist_ok=True)
+		tmp_file = self.path + "manifest.json." + str(os.getpid()) + ".tmp"
+		open(tmp_file, "w").write(json.dumps(self.entries))
+		os.replace(tmp_file, self.path + "manifest.json")
+		# drop results of files that changed or disappeared
+		used = {entry["hash"] + ".pickle" for entry in self.entries.values()}
+		for file in os.listdir(self.path):
+			if file.endswith(".pickle") and file not in used:
+				os.remove(self.path + file)
+
+
+def parse_files(
+	files: list[str],
+	jobs: int = 1,
+	failures: list[tuple[str, Exception]] | None = None,
+	manifest: ParseManifest | None = None,
+	entity_filter: EntityFilter | None = None,
+	read_ahead: int = 2,
+	use_mmap: bool = False,
+) -> Iterator[Entity]:
+	# with jobs > 1 files are parsed in worker processes, results still come back in order
+	# otherwise up to read_ahead files are read and decompressed on threads while
+	# the current one is parsed, 0 does everything in series
+	# if failures is given, files that fail are recorded there instead of raising
+	# with a manifest only files that changed since the last run are parsed
+	# the manifest only stores whole files, filtered parses are not kept
+	with ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as executor:
+		digests = [
+			manifest.cached(file) if manifest is not None else None for file in files
+		]
+		pool = BufferPool()
+		prefetched = None
+		if executor is None and read_ahead > 0:
+			prefetched = prefetch_files(
+				[file for file, digest in zip(files, digests) if digest is None],
+				pool,
+				read_ahead,
+				use_mmap,
+			)
+		results: list[tuple[Callable[[], list[Entity]], bool]] = []  # (result, parsed)
+		for file, digest in zip(files, digests):
+			if digest is not None:
+				results.append((partial(manifest.load, digest), False))  # type: ignore
+			elif prefetched is not None:
+				results.append(
+					(partial(parse_prefetched, prefetched, pool, entity_filter), True)
+				)
+			elif executor is None:
+				results.append((partial(parse_file, file, entity_filter), True))
+			else:
+				future = executor.submit(parse_file_flat, file, entity_filter)
+				results.append((partial(flat_result, future), True))
+		for file, (result, parsed) in zip(files, results):
+			try:
+				entities = result()
+			except Exception as e:
+				if failures is None:
+					raise Exception("Error in file " + os.path.basename(file)) from e
+				failures.append((file, e))
+				continue
+			if not parsed and entity_filter is not None:
+				entities = list(entity_filter.select(entities))
+			if manifest is not None and parsed and entity_filter is None:
+				manifest.store(file, entities)
+			yield from entities
+	if manifest is not None:
+		manifest.save(files)
+
+
+def iter_entities(
+	path: str, lazy: bool = False, entity_filter: EntityFilter | None = None
+) -> Iterator[Entity]:
+	if not os.path.isdir(path):
+		yield from iter_parse(open(path, "rb").read(), lazy, entity_filter)
+		return
+	for file in entity_files(path):
+		try:
+			yield from iter_parse(open(file, "rb").read(), lazy, entity_filter)
+		except Exception as e:
+			raise Exception("Error in file " + os.path.basename(file)) from e
+
+
+def write_type(
+	writer: Writer,
+	t: str,
+	value: Any,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+):
+	write_value(writer, describe_type(t), value, type_sizes)
+
+
+def save_type(
+	t: str, value: Any, type_sizes: dict[str, int], component_data: ComponentData
+) -> bytes:
+	writer = Writer()
+	write_type(writer, t, value, type_sizes, component_data)
+	return bytes(writer.data)
+
+
+def fields_decoded(component: Component) -> bool:
+	# reads the slot directly, so unlike component.fields this never decodes
+	try:
+		Component.fields.__get__(component)
+	except AttributeError:
+		return False
+	return True
+
+
+def write_component(
+	writer: Writer,
+	component: Component,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+	decoders: ComponentDecoders | None = None,
+):
+	writer.write_string(component.name)
+	writer.write_bytes(component.not_deleted_maybe)
+	writer.write_bytes(b"\x01" if component.enabled else b"\x00")
+	writer.write_string(",".join(component.tags))
+	if component.source is not None and not fields_decoded(component):
+		# lazy and never decoded, so the original bytes are still correct
+		data, start, end, _ = component.source
+		writer.write_bytes(data[start:end])
+	elif decoders is not None:
+		decoders[component.name].write(writer, component.fields)
 	else:
-		if t in object_map.keys():
-			for field in object_map[t]:
-				data += save_type(field[1], value[field[0]], type_sizes, component_data)
-			return data
-		raise Exception("unknown type: " + t)
-	return data
+		for field in component_data[component.name]:
+			write_type(
+				writer,
+				field.typename,
+				component.fields[field.field],
+				type_sizes,
+				component_data,
+			)
 
 
 def save_component(
 	component: Component, type_sizes: dict[str, int], component_data: ComponentData
 ) -> bytes:
-	data = b""
-	component_type = component.name
-	data += struct.pack("i", len(component_type))[::-1]
-	data += component_type.encode()
-	data += component.not_deleted_maybe
-	data += struct.pack("b", component.enabled)
-	tags = ",".join(component.tags)
-	data += struct.pack("i", len(tags))[::-1]
-	data += tags.encode()
-	component_fields = component_data[component_type]
-	for field in component_fields:
-		ty = field.typename
-		data += save_type(ty, component.fields[field.field], type_sizes, component_data)
-
-	return data
+	writer = Writer()
+	write_component(writer, component, type_sizes, component_data)
+	return bytes(writer.data)
+
+
+def write_entity(
+	writer: Writer,
+	entity: Entity,
+	type_sizes: dict[str, int],
+	component_data: ComponentData,
+	decoders: ComponentDecoders | None = None,
+):
+	# writes the whole subtree, depth first like parse_data reads it
+	stack = [entity]
+	while stack:
+		entity = stack.pop()
+		writer.write_string(entity.name)
+		writer.write_bytes(entity.deleted_maybe)
+		writer.write_string(entity.path)
+		writer.write_string(",".join(entity.tags))
+		writer.write_struct(
+			transform_struct,
+			entity.x,
+			entity.y,
+			entity.size_x,
+			entity.size_y,
+			entity.rotation,
+		)
+		writer.write_be(4, len(entity.components))
+		for component in entity.components:
+			write_component(writer, component, type_sizes, component_data, decoders)
+		writer.write_be(4, len(entity.children))
+		stack.extend(reversed(entity.children))
 
 
 def save_entity(entity: Entity, type_sizes, component_data) -> bytes:
-	data = b""
-	data += struct.pack("i", len(entity.name))[::-1]
-	data += entity.name.encode()
-	data += entity.deleted_maybe
-	data += struct.pack("i", len(entity.path))[::-1]
-	data += entity.path.encode()
-	tags = ",".join(entity.tags)
-	data += struct.pack("i", len(tags))[::-1]
-	data += tags.encode()
-	data += struct.pack("f", entity.x)[::-1]
-	data += struct.pack("f", entity.y)[::-1]
-	data += struct.pack("f", entity.size_x)[::-1]
-	data += struct.pack("f", entity.size_y)[::-1]
-	data += struct.pack("f", entity.rotation)[::-1]
-	data += struct.pack("i", len(entity.components))[::-1]
-	for component in entity.components:
-		data += save_component(component, type_sizes, component_data)
-	data += struct.pack("i", len(entity.children))[::-1]
-	for child in entity.children:
-		save_entity(child, type_sizes, component_data)
-	return data
+	writer = Writer()
+	write_entity(writer, entity, type_sizes, component_data)
+	return bytes(writer.data)
 
 
 def save(entities: list[Entity], schema: str) -> bytes:
-	data = b""
+	writer = Writer()
 	if len(entities) == 0:
-		data += b"\x00\x02\x00\x20"
-		data += b"\x00\x00\x00\x00"
-		data += (
+		writer.write_bytes(b"\x00\x02\x00\x20")
+		writer.write_bytes(b"\x00\x00\x00\x00")
+		writer.write_bytes(
 			b"\x00" * 0x24
 		)  # ?? maybe hash of 00 00, and entity count of 0? 0x20 + 0x04 = 0x24
-		return data
-	data += b"\x00\x00\x00\x02"
-	data += b"\x00\x00\x00\x20"
-	data += schema.encode()
-	data += struct.pack("i", len(entities))[::-1]
+		return bytes(writer.data)
+	writer.write_bytes(b"\x00\x00\x00\x02")
+	writer.write_bytes(b"\x00\x00\x00\x20")
+	writer.write_bytes(schema.encode())
+	writer.write_be(4, len(entities))
 	type_sizes, component_data = get_schema_data(schema.encode())
+	decoders = get_decoders(schema.encode(), type_sizes, component_data)
 	for entity in entities:
-		data += save_entity(entity, type_sizes, component_data)
-	return data
+		write_entity(writer, entity, type_sizes, component_data, decoders)
+	return bytes(writer.data)
 
 
-if __name__ == "__main__":
-	path = sys.argv[1]
+def save_file(file: str, entities: list[Entity], schema: str):
+	write_compressed(file, save(entities, schema))
+
+
+def write_compressed(file: str, data: bytes | bytearray):
+	compressed = compress(data)
+	# written next to the target then renamed, so the game never sees half a file
+	tmp_file = file + "." + str(os.getpid()) + ".tmp"
+	with open(tmp_file, "wb") as f:
+		f.write(compressed)
+	os.replace(tmp_file, file)
+
+
+def rewrite_file(
+	file: str,
+	out_file: str,
+	edit: Callable[[list[Entity]], None] | None = None,
+):
+	# parse, optionally edit in place, and write back a real entities file
+	schema, entities = load_file(file)
+	if edit is not None:
+		edit(entities)
+	save_file(out_file, entities, schema)
+
+
+@dataclass
+class EntityOffsets:
+	name: str
+	path: str
+	tags: list[str]
+	depth: int  # 0 for top level entities
+	transform: int  # offset of x, y, size_x, size_y and rotation
+	components: list[tuple[str, int, int]]  # name and span of the fields
+
+
+def scan_offsets(
+	reader: Reader, decoders: ComponentDecoders, maybe_num_entities: int
+) -> list[EntityOffsets]:
+	# every entity depth first, with components skipped instead of decoded
 	entities = []
-	if os.path.isdir(path):
-		if path[-1] != "/":
-			path += "/"
-		files = os.listdir(path)
-		files = [x for x in files if "entities" in x]
-		entities = []
-		for file in files:
-			compressed_data = open(path + file, "rb").read()
+	stack = [maybe_num_entities]  # entities left to read at each depth
+	while stack:
+		if stack[-1] == 0:
+			stack.pop()
+			continue
+		stack[-1] -= 1
+		name = reader.read_string()
+		reader.ptr += 1  # deleted
+		path = reader.read_string()
+		tags = reader.read_string().split(",")
+		transform = reader.ptr
+		reader.ptr += transform_struct.size
+		components = []
+		for _ in range(reader.read_be(4)):
+			component_name = reader.read_string()
+			reader.ptr += 2  # deleted, enabled
+			skip_string(reader)  # tags
+			start = reader.ptr
+			decoders[component_name].skip(reader)
+			components.append((component_name, start, reader.ptr))
+		entities.append(
+			EntityOffsets(name, path, tags, len(stack) - 1, transform, components)
+		)
+		stack.append(reader.read_be(4))
+	return entities
+
+
+class EntityPatcher:
+	# edits single values of a file without building or saving every entity
+	# values that keep their size are packed straight into the decompressed data,
+	# others are spliced in when the file is written. entities are numbered depth
+	# first, as in entities, and offsets always refer to the original layout
+	def __init__(self, compressed_data: bytes) -> None:
+		self.data = bytearray(decompress(compressed_data))
+		reader = Reader(self.data)
+		hash, maybe_num_entities = read_header(reader)
+		self.schema = bstr(hash)
+		self.type_sizes, self.component_data = get_schema_data(hash)
+		self.decoders = get_decoders(hash, self.type_sizes, self.component_data)
+		self.entities = scan_offsets(reader, self.decoders, maybe_num_entities)
+		self.splices: dict[int, tuple[int, bytes]] = {}  # start -> (end, new bytes)
+
+	def component(self, entity: int, component: int | str) -> tuple[str, int, int]:
+		components = self.entities[entity].components
+		if isinstance(component, int):
+			return components[component]
+		for found in components:
+			if found[0] == component:
+				return found
+		raise KeyError(component)
+
+	def field(
+		self, entity: int, component: int | str, field: str
+	) -> tuple[str, int, int]:
+		# type and span of one field
+		component_name, start, _ = self.component(entity, component)
+		reader = Reader(self.data, start)
+		for field_data in self.component_data[component_name]:
+			decoder = self.decoders.type(field_data.typename)
+			start = reader.ptr
+			if isinstance(decoder, FixedLayout):
+				reader.ptr += decoder.size
+			else:
+				decoder.skip(reader)
+			if field_data.field == field:
+				return field_data.typename, start, reader.ptr
+		raise KeyError(field)
+
+	def value_bytes(self, start: int, end: int) -> bytes | bytearray:
+		if start in self.splices:
+			return self.splices[start][1]
+		return self.data[start:end]
+
+	def patch(self, start: int, end: int, value: bytes | bytearray):
+		if start in self.splices or len(value) != end - start:
+			self.splices[start] = (end, bytes(value))
+		else:
+			self.data[start:end] = value
+
+	def get_field(self, entity: int, component: int | str, field: str) -> Any:
+		t, start, end = self.field(entity, component, field)
+		return layout_variable(self.decoders.type(t)).read(
+			Reader(self.value_bytes(start, end))
+		)
 
+	def set_field(self, entity: int, component: int | str, field: str, value: Any):
+		t, start, end = self.field(entity, component, field)
+		writer = Writer()
+		layout_variable(self.decoders.type(t)).write(writer, value)
+		self.patch(start, end, writer.data)
+
+	def get_transform(self, entity: int) -> tuple[float, float, float, float, float]:
+		# x, y, size_x, size_y, rotation
+		return transform_struct.unpack_from(self.data, self.entities[entity].transform)
+
+	def set_transform(self, entity: int, **values: float):
+		# any of x, y, size_x, size_y and rotation
+		names = ["x", "y", "size_x", "size_y", "rotation"]
+		current = dict(zip(names, self.get_transform(entity)))
+		for name, value in values.items():
+			if name not in current:
+				raise KeyError(name)
+			current[name] = value
+		transform_struct.pack_into(
+			self.data, self.entities[entity].transform, *current.values()
+		)
+
+	def to_bytes(self) -> bytes | bytearray:
+		if not self.splices:
+			return self.data
+		out = bytearray()
+		pos = 0
+		for start in sorted(self.splices):
+			end, value = self.splices[start]
+			out += self.data[pos:start]
+			out += value
+			pos = end
+		out += self.data[pos:]
+		return out
+
+
+def layout_variable(decoder: TypeDecoder) -> VariableLayout:
+	if isinstance(decoder, FixedLayout):
+		return fixed_layout_variable(decoder)
+	return decoder
+
+
+def patch_file(file: str, out_file: str, edit: Callable[[EntityPatcher], None]):
+	patcher = EntityPatcher(open(file, "rb").read())
+	edit(patcher)
+	write_compressed(out_file, patcher.to_bytes())
+
+
+def rewrite_files(
+	files: list[str],
+	out_dir: str,
+	jobs: int = 1,
+	failures: list[tuple[str, Exception]] | None = None,
+	edit: Callable[[list[Entity]], None] | None = None,
+):
+	# edit must be picklable when jobs > 1
+	os.makedirs(out_dir, exist_ok=True)
+	with ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as executor:
+		results: list[Callable[[], None]] = []
+		for file in files:
+			out_file = os.path.join(out_dir, os.path.basename(file))
+			if executor is None:
+				results.append(partial(rewrite_file, file, out_file, edit))
+			else:
+				results.append(executor.submit(rewrite_file, file, out_file, edit).result)
+		for file, result in zip(files, results):
 			try:
-				parsed = parse_data(compressed_data)
+				result()
 			except Exception as e:
-				raise Exception("Error in file " + file) from e
+				if failures is None:
+					raise Exception("Error in file " + os.path.basename(file)) from e
+				failures.append((file, e))
 
-			entities += parsed
-	else:
-		entities = parse_data(open(path, "rb").read())
-	open("./output.json", "w").write(
-		json.dumps(
-			{"entities": entities},
-			default=lambda x: str(x) if isinstance(x, bytes) else x.__dict__,
+
+def reader_position(reader: Reader) -> int:
+	return reader.ptr
+
+
+def writer_position(writer: Writer) -> int:
+	return len(writer.data)
+
+
+class DecodeProfile:
+	# calls, bytes and cumulative seconds per (kind, op, name)
+	# nested types are counted inside their parent as well
+	def __init__(self) -> None:
+		self.stats: dict[tuple[str, str, str], list] = {}
+
+	def add(self, key: tuple[str, str, str], size: int, seconds: float):
+		entry = self.stats.get(key)
+		if entry is None:
+			self.stats[key] = [1, size, seconds]
+			return
+		entry[0] += 1
+		entry[1] += size
+		entry[2] += seconds
+
+	def wrap(
+		self,
+		kind: str,
+		op: str,
+		fn: Callable,
+		name_of: Callable[[tuple, Any], str],
+		position: Callable[[Any], int] = reader_position,
+	) -> Callable:
+		# fn takes a reader or writer first, bytes are how far its position moved
+		# name_of gets the remaining arguments and the result
+		def profiled(target, *args, **kwargs):
+			before = position(target)
+			start = time.perf_counter()
+			value = fn(target, *args, **kwargs)
+			seconds = time.perf_counter() - start
+			self.add((kind, op, name_of(args, value)), position(target) - before, seconds)
+			return value
+
+		return profiled
+
+	def wrap_layout(self, t: str, decoder: TypeDecoder) -> VariableLayout:
+		# fixed types lose their merged struct reads so they can be timed on their own
+		if isinstance(decoder, FixedLayout):
+			decoder = fixed_layout_variable(decoder)
+		name_of = partial(type_name, t)
+		return VariableLayout(
+			self.wrap("type", "read", decoder.read, name_of),
+			self.wrap("type", "skip", decoder.skip, name_of),
+			self.wrap("type", "write", decoder.write, name_of, writer_position),
 		)
+
+	def rows(self) -> list[dict[str, Any]]:
+		rows = [
+			{
+				"kind": kind,
+				"op": op,
+				"name": name,
+				"calls": calls,
+				"bytes": size,
+				"seconds": seconds,
+			}
+			for (kind, op, name), (calls, size, seconds) in self.stats.items()
+		]
+		rows.sort(key=lambda row: row["seconds"], reverse=True)
+		return rows
+
+	def report(self, out: TextIO, limit: int | None = None):
+		header = ("calls", "bytes", "seconds", "op", "name")
+		out.write("%10s %12s %10s %6s  %s\n" % header)
+		for row in self.rows()[:limit]:
+			out.write(
+				"%10d %12d %10.4f %6s  %s %s\n"
+				% (
+					row["calls"],
+					row["bytes"],
+					row["seconds"],
+					row["op"],
+					row["kind"],
+					row["name"],
+				)
+			)
+
+
+def type_name(t: str, args: tuple, value: Any) -> str:
+	return t
+
+
+def fixed_layout_variable(layout: FixedLayout) -> VariableLayout:
+	layout_struct = struct.Struct(">" + layout.fmt)
+	build, flatten = layout.build, layout.flatten
+
+	def read(reader: Reader) -> Any:
+		values = reader.read_struct(layout_struct)
+		return values[0] if build is None else build(values)
+
+	def skip(reader: Reader):
+		reader.ptr += layout_struct.size
+
+	def write(writer: Writer, value: Any):
+		values = [value] if flatten is None else flatten(value)
+		writer.write_struct(layout_struct, *values)
+
+	return VariableLayout(read, skip, write)
+
+
+def enable_profiling() -> DecodeProfile:
+	# swaps the decode and encode entry points for timed ones, and compiled types are
+	# wrapped as they are compiled, so nothing is paid while profiling is off
+	global profile, parse_component, do_type, write_component, write_type
+	if profile is not None:
+		return profile
+	profile = DecodeProfile()
+	schema_decoders.clear()  # compiled again, this time with timed types
+	parse_component = profile.wrap(
+		"component", "read", parse_component, lambda args, comp: comp.name
+	)
+	do_type = profile.wrap("type", "read", do_type, lambda args, value: args[0])
+	write_component = profile.wrap(
+		"component",
+		"write",
+		write_component,
+		lambda args, value: args[0].name,
+		writer_position,
+	)
+	write_type = profile.wrap(
+		"type", "write", write_type, lambda args, value: args[0], writer_position
+	)
+	return profile
+
+
+def json_default(x: Any) -> Any:
+	if isinstance(x, bytes):
+		return str(x)
+	if isinstance(x, array):
+		return x.tolist()
+	if isinstance(x, Component):
+		return component_json(x)
+	if isinstance(x, Entity):
+		return entity_json(x)
+	return x.__dict__
+
+
+def component_json(component: Component) -> dict[str, Any]:
+	return {
+		"name": component.name,
+		"tags": component.tags,
+		"fields": component.fields,
+		"enabled": component.enabled,
+		"not_deleted_maybe": str(component.not_deleted_maybe),
+	}
+
+
+def entity_json(entity: Entity) -> dict[str, Any]:
+	return dict(
+		entity_head_json(entity),
+		children=[entity_json(c) for c in entity.children],
+		deleted_maybe=str(entity.deleted_maybe),
+	)
+
+
+def entity_head_json(entity: Entity) -> dict[str, Any]:
+	# every key of entity_json up to its children
+	return {
+		"name": entity.name,
+		"path": entity.path,
+		"tags": entity.tags,
+		"x": entity.x,
+		"y": entity.y,
+		"size_x": entity.size_x,
+		"size_y": entity.size_y,
+		"rotation": entity.rotation,
+		"components": [component_json(c) for c in entity.components],
+	}
+
+
+def encode_entity(entity: Entity, encoder: json.JSONEncoder) -> str:
+	# the same text as encoding entity_json, but with a stack instead of recursion,
+	# so chains of children can be deeper than the recursion limit
+	parts: list[str] = []
+	stack: list[Entity | str] = [entity]
+	while stack:
+		item = stack.pop()
+		if isinstance(item, str):
+			parts.append(item)
+			continue
+		parts.append(encoder.encode(entity_head_json(item))[:-1])
+		parts.append(', "children": [')
+		stack.append('], "deleted_maybe": ' + encoder.encode(str(item.deleted_maybe)) + "}")
+		for i in range(len(item.children) - 1, -1, -1):
+			stack.append(item.children[i])
+			if i != 0:
+				stack.append(", ")
+	return "".join(parts)
+
+
+def write_json(entities: Iterable[Entity], out: TextIO, ndjson: bool = False):
+	# entities are encoded one at a time, so only one is held as json at once
+	encoder = json.JSONEncoder(default=json_default)
+	if ndjson:
+		for entity in entities:
+			out.write(encode_entity(entity, encoder))
+			out.write("\n")
+		return
+	out.write('{"entities": [')
+	for i, entity in enumerate(entities):
+		if i != 0:
+			out.write(", ")
+		out.write(encode_entity(entity, encoder))
+	out.write("]}")
+
+
+def pair(
+	old: list[T],
+	new: list[T],
+	keys: list[Callable[[T], Any]],
+	group_of: Callable[[T], Any],
+) -> list[tuple[int | None, int | None]]:
+	# items have no ids, so those with the same key are paired first, one key after
+	# another, then the rest of each group in order
+	# indices into old and new, None on the side that is missing
+	matches: list[int | None] = [None] * len(new)
+	used: set[int] = set()
+	for key_of in keys:
+		by_key: dict[Any, list[int]] = {}
+		for i, item in enumerate(old):
+			if i not in used:
+				by_key.setdefault(key_of(item), []).append(i)
+		for j, item in enumerate(new):
+			if matches[j] is None:
+				same = by_key.get(key_of(item))
+				if same:
+					matches[j] = same.pop(0)
+					used.add(matches[j])  # type: ignore
+	groups: dict[Any, list[int]] = {}
+	for i, item in enumerate(old):
+		if i not in used:
+			groups.setdefault(group_of(item), []).append(i)
+	pairs: list[tuple[int | None, int | None]] = []
+	for j, (item, i) in enumerate(zip(new, matches)):
+		if i is None:
+			rest = groups.get(group_of(item))
+			i = rest.pop(0) if rest else None
+		pairs.append((i, j))
+	pairs += [(i, None) for rest in groups.values() for i in rest]
+	return pairs
+
+
+def entity_group(entity: Any) -> tuple[str, str]:
+	return entity.path, entity.name
+
+
+def entity_place(entity: Any) -> tuple[str, str, float, float]:
+	return entity.path, entity.name, entity.x, entity.y
+
+
+def component_name(component: Any) -> str:
+	return component.name
+
+
+def name_indices(components: list[Any]) -> list[int]:
+	# which of the components with its name each one is, the component_index of events
+	seen: dict[str, int] = {}
+	indices = []
+	for component in components:
+		n = seen.get(component.name, 0)
+		seen[component.name] = n + 1
+		indices.append(n)
+	return indices
+
+
+def entity_event(
+	file: str, locator: str, entity: Any, event: str, **values: Any
+) -> dict[str, Any]:
+	# every change reported by watch and diff.py, locator is the index path of the
+	# entity in the new file, or in the old one if it was removed
+	return dict(
+		file=file, entity=locator, path=entity.path, name=entity.name, event=event, **values
+	)
+
+
+def entity_deltas(
+	file: str, old: list[Entity], new: list[Entity]
+) -> Iterator[dict[str, Any]]:
+	# children are paired within their paired parent, entities that kept their
+	# position are paired first
+	stack = [(old, new, "")]
+	while stack:
+		old, new, prefix = stack.pop()
+		for i, j in pair(old, new, [entity_place], entity_group):
+			if j is None:
+				entity = old[i]  # type: ignore
+				locator = prefix + str(i)
+				yield entity_event(file, locator, entity, "removed", x=entity.x, y=entity.y)
+				continue
+			entity = new[j]
+			locator = prefix + str(j)
+			if i is None:
+				yield entity_event(file, locator, entity, "added", x=entity.x, y=entity.y)
+				continue
+			old_entity = old[i]
+			if not same_value((old_entity.x, old_entity.y), (entity.x, entity.y)):
+				yield entity_event(
+					file,
+					locator,
+					entity,
+					"moved",
+					old=(old_entity.x, old_entity.y),
+					new=(entity.x, entity.y),
+				)
+			elif not same_value(entity_header(old_entity), entity_header(entity)):
+				yield entity_event(file, locator, entity, "header changed")
+			yield from component_deltas(file, locator, old_entity, entity)
+			stack.append((old_entity.children, entity.children, locator + "/"))
+
+
+def same_value(a: Any, b: Any) -> bool:
+	# == but with nan equal to nan, as their packed bytes are
+	if isinstance(a, float) and isinstance(b, float):
+		return a == b or (a != a and b != b)
+	if isinstance(a, dict) and isinstance(b, dict):
+		return a.keys() == b.keys() and all(same_value(a[k], b[k]) for k in a)
+	if isinstance(a, (list, tuple)) and type(a) is type(b):
+		return len(a) == len(b) and all(same_value(x, y) for x, y in zip(a, b))
+	return a == b
+
+
+def entity_header(entity: Entity) -> tuple:
+	# what diff.py hashes as the header, besides the position
+	return (
+		entity.tags,
+		entity.size_x,
+		entity.size_y,
+		entity.rotation,
+		entity.deleted_maybe,
+	)
+
+
+def component_deltas(
+	file: str, locator: str, old_entity: Entity, entity: Entity
+) -> Iterator[dict[str, Any]]:
+	old, new = old_entity.components, entity.components
+	old_indices, new_indices = name_indices(old), name_indices(new)
+	for i, j in pair(old, new, [], component_name):
+		if j is None:
+			yield entity_event(
+				file,
+				locator,
+				entity,
+				"component removed",
+				component=old[i].name,  # type: ignore
+				component_index=old_indices[i],  # type: ignore
+			)
+			continue
+		component = new[j]
+		where = {"component": component.name, "component_index": new_indices[j]}
+		if i is None:
+			yield entity_event(
+				file, locator, entity, "component added", **where, fields=component.fields
+			)
+			continue
+		old_component = old[i]
+		changed = False
+		if old_component.fields != component.fields:
+			for name, value in component.fields.items():
+				old_value = old_component.fields.get(name)
+				if not same_value(old_value, value):
+					changed = True
+					yield entity_event(
+						file,
+						locator,
+						entity,
+						"field changed",
+						**where,
+						field=name,
+						old=old_value,
+						new=value,
+					)
+		if not changed and (
+			old_component.tags,
+			old_component.enabled,
+			old_component.not_deleted_maybe,
+		) != (component.tags, component.enabled, component.not_deleted_maybe):
+			yield entity_event(file, locator, entity, "component changed", **where)
+
+
+def stat_files(path: str) -> dict[str, tuple[int, int]]:
+	stats = {}
+	for file in entity_files(path):
+		try:
+			stat = os.stat(file)
+		except OSError:
+			continue  # removed between listing and stat
+		stats[file] = (stat.st_size, stat.st_mtime_ns)
+	return stats
+
+
+async def watch(
+	path: str,
+	emit: Callable[[dict[str, Any]], None],
+	interval: float = 1.0,
+	initial: bool = False,
+):
+	# polls the directory by stat and parses only files whose size or mtime changed
+	# a file that fails to parse is likely still being written, it is retried once
+	# its size or mtime change. with initial the first scan reports everything as
+	# added, otherwise a file's first parse is only a baseline if it was there
+	# on the first scan, even when that parse only succeeds on a later poll
+	loop = asyncio.get_running_loop()
+	stats: dict[str, tuple[int, int]] = {}
+	failed: dict[str, tuple[int, int]] = {}
+	snapshots: dict[str, list[Entity]] = {}
+	baseline: set[str] = set()  # files whose first parse is not reported
+	first = True
+	while True:
+		current = await loop.run_in_executor(None, stat_files, path)
+		if first and not initial:
+			baseline = set(current)
+		for file in list(stats):
+			if file not in current:
+				old = snapshots.pop(file)
+				for delta in entity_deltas(os.path.basename(file), old, []):
+					emit(delta)
+				del stats[file]
+		for file in list(failed):
+			if file not in current:
+				del failed[file]
+				baseline.discard(file)
+		for file, stat in current.items():
+			if stats.get(file) == stat or failed.get(file) == stat:
+				continue
+			try:
+				entities = await loop.run_in_executor(None, parse_file, file)
+			except Exception:
+				failed[file] = stat
+				continue
+			failed.pop(file, None)
+			if file not in baseline:
+				for delta in entity_deltas(
+					os.path.basename(file), snapshots.get(file, []), entities
+				):
+					emit(delta)
+			baseline.discard(file)
+			stats[file] = stat
+			snapshots[file] = entities
+		first = False
+		await asyncio.sleep(interval)
+
+
+def print_delta(delta: dict[str, Any]):
+	print(json.dumps(delta, default=json_default), flush=True)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("path", help="entities_*.bin file or world directory")
+	parser.add_argument(
+		"-j", "--jobs", type=int, default=1, help="parse files in N processes"
+	)
+	parser.add_argument(
+		"--incremental",
+		action="store_true",
+		help="reuse cached results for files that have not changed since the last run",
+	)
+	parser.add_argument(
+		"--keep-going",
+		action="store_true",
+		help="report files that fail to parse instead of stopping",
+	)
+	parser.add_argument("-o", "--output", default="./output.json")
+	parser.add_argument(
+		"--format",
+		choices=["json", "ndjson"],
+		default="json",
+		help="ndjson writes one top level entity per line",
+	)
+	parser.add_argument(
+		"--write-bin",
+		metavar="DIR",
+		help="write every input file back to DIR as a compressed entities file "
+		"instead of dumping json",
 	)
-	open("./saved", "wb").write(save(entities, "c8ecfb341d22516067569b04563bff9c"))
+	parser.add_argument(
+		"--watch",
+		action="store_true",
+		help="keep polling the directory and print entity changes as json lines",
+	)
+	parser.add_argument(
+		"--interval", type=float, default=1.0, help="seconds between --watch polls"
+	)
+	parser.add_argument(
+		"--read-ahead",
+		type=int,
+		default=2,
+		metavar="N",
+		help="read and decompress up to N files on threads while parsing, 0 to disable",
+	)
+	parser.add_argument(
+		"--mmap", action="store_true", help="map input files instead of reading them"
+	)
+	parser.add_argument(
+		"--path-glob", help="only keep entities whose path matches, like data/*/props/*"
+	)
+	parser.add_argument(
+		"--tag",
+		action="append",
+		default=[],
+		help="only keep entities with this tag, can be given more than once",
+	)
+	parser.add_argument(
+		"--bbox",
+		nargs=4,
+		type=float,
+		metavar=("X0", "Y0", "X1", "Y1"),
+		help="only keep entities positioned inside this rectangle",
+	)
+	parser.add_argument(
+		"--profile",
+		action="store_true",
+		help="print time and bytes spent per component and type to stderr",
+	)
+	parser.add_argument(
+		"--profile-json", metavar="FILE", help="write the profile to FILE as json"
+	)
+	args = parser.parse_args()
+	failures: list[tuple[str, Exception]] | None = [] if args.keep_going else None
+	if args.profile or args.profile_json is not None:
+		enable_profiling()
+		args.jobs = 1  # worker processes would keep their own counts
+	if args.watch:
+		try:
+			asyncio.run(watch(args.path, print_delta, args.interval))
+		except KeyboardInterrupt:
+			pass
+	elif args.write_bin is not None:
+		rewrite_files(entity_files(args.path), args.write_bin, args.jobs, failures)
+	else:
+		manifest = ParseManifest(args.path) if args.incremental else None
+		entity_filter = None
+		if args.path_glob is not None or args.tag or args.bbox is not None:
+			entity_filter = EntityFilter(
+				args.path_glob, args.tag, None if args.bbox is None else tuple(args.bbox)
+			)
+		files = entity_files(args.path)
+		entities: Iterable[Entity] = parse_files(
+			files,
+			args.jobs,
+			failures,
+			manifest,
+			entity_filter,
+			args.read_ahead,
+			args.mmap,
+		)
+		if config.dump_saved:
+			entities = list(entities)  # held for the dump below
+		# written next to the output then renamed, so a failed parse keeps the old one
+		tmp_file = args.output + "." + str(os.getpid()) + ".tmp"
+		try:
+			with open(tmp_file, "w") as out:
+				write_json(entities, out, args.format == "ndjson")
+		except BaseException:
+			os.remove(tmp_file)
+			raise
+		os.replace(tmp_file, args.output)
+		if config.dump_saved and files:
+			open("./saved", "wb").write(save(entities, file_schema_hash(files[0])))  # type: ignore
+	for file, error in failures or []:
+		print(
+			"Error in file " + os.path.basename(file) + ": " + repr(error),
+			file=sys.stderr,
+		)
+	if profile is not None:
+		if args.profile_json is not None:
+			with open(args.profile_json, "w") as out:
+				json.dump(profile.rows(), out, indent="\t")
+		if args.profile:
+			profile.report(sys.stderr)
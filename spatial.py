@@ -0,0 +1,142 @@
+import heapq
+import math
+from typing import Iterable, Iterator
+
+from main import Entity, entity_files, parse_files
+
+chunk_size = 512
+
+
+class SpatialIndex:
+	# uniform grid of chunk_size cells holding (x, y, entity)
+	def __init__(self, cell_size: float = chunk_size) -> None:
+		self.cell_size = cell_size
+		self.cells: dict[tuple[int, int], list[tuple[float, float, Entity]]] = {}
+		self.count = 0
+		self.bounds: tuple[int, int, int, int] | None = None  # cells, inclusive
+		self.unplaced: list[Entity] = []  # nan or infinite positions, in no cell
+
+	def __len__(self) -> int:
+		return self.count
+
+	def cell(self, x: float, y: float) -> tuple[int, int]:
+		return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+	def insert(self, entity: Entity, children: bool = True):
+		stack = [entity]
+		while stack:
+			entity = stack.pop()
+			if children:
+				stack.extend(entity.children)
+			self.count += 1
+			if not (math.isfinite(entity.x) and math.isfinite(entity.y)):
+				self.unplaced.append(entity)
+				continue
+			key = self.cell(entity.x, entity.y)
+			self.cells.setdefault(key, []).append((entity.x, entity.y, entity))
+			if self.bounds is None:
+				self.bounds = (key[0], key[1], key[0], key[1])
+			else:
+				x0, y0, x1, y1 = self.bounds
+				self.bounds = (
+					min(x0, key[0]),
+					min(y0, key[1]),
+					max(x1, key[0]),
+					max(y1, key[1]),
+				)
+
+	def extend(self, entities: Iterable[Entity], children: bool = True):
+		for entity in entities:
+			self.insert(entity, children)
+
+	def cells_in(
+		self, x0: float, y0: float, x1: float, y1: float
+	) -> Iterator[list[tuple[float, float, Entity]]]:
+		if self.bounds is None:
+			return
+		# clamped to the occupied cells, which keeps infinite or nan bounds finite
+		bx0, by0, bx1, by1 = self.bounds
+		size = self.cell_size
+		cx0, cy0 = self.cell(max(bx0 * size, x0), max(by0 * size, y0))
+		cx1, cy1 = self.cell(min((bx1 + 1) * size, x1), min((by1 + 1) * size, y1))
+		if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+			# walking the occupied cells is cheaper than walking the rect
+			for (cx, cy), entries in self.cells.items():
+				if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+					yield entries
+			return
+		for cx in range(cx0, cx1 + 1):
+			for cy in range(cy0, cy1 + 1):
+				entries = self.cells.get((cx, cy))
+				if entries is not None:
+					yield entries
+
+	def query_rect(self, x0: float, y0: float, x1: float, y1: float) -> list[Entity]:
+		return [
+			entity
+			for entries in self.cells_in(x0, y0, x1, y1)
+			for x, y, entity in entries
+			if x0 <= x <= x1 and y0 <= y <= y1
+		]
+
+	def query_radius(self, x: float, y: float, radius: float) -> list[Entity]:
+		r2 = radius * radius
+		return [
+			entity
+			for entries in self.cells_in(x - radius, y - radius, x + radius, y + radius)
+			for ex, ey, entity in entries
+			if (ex - x) * (ex - x) + (ey - y) * (ey - y) <= r2
+		]
+
+	def ring(self, cx: int, cy: int, r: int) -> Iterator[tuple[int, int]]:
+		if r == 0:
+			yield cx, cy
+			return
+		for dx in range(-r, r + 1):
+			yield cx + dx, cy - r
+			yield cx + dx, cy + r
+		for dy in range(-r + 1, r):
+			yield cx - r, cy + dy
+			yield cx + r, cy + dy
+
+	def nearest(self, x: float, y: float, k: int = 1) -> list[tuple[float, Entity]]:
+		# (distance, entity) pairs, closest first
+		if self.bounds is None or k <= 0:
+			return []
+		if not (math.isfinite(x) and math.isfinite(y)):
+			return []
+		cx, cy = self.cell(x, y)
+		bx0, by0, bx1, by1 = self.bounds
+		max_ring = max(abs(cx - bx0), abs(cx - bx1), abs(cy - by0), abs(cy - by1))
+		best: list[tuple[float, int, Entity]] = []  # max heap on -distance
+
+		def offer(entries: list[tuple[float, float, Entity]]):
+			for ex, ey, entity in entries:
+				d = (ex - x) * (ex - x) + (ey - y) * (ey - y)
+				if len(best) < k:
+					heapq.heappush(best, (-d, id(entity), entity))
+				elif d < -best[0][0]:
+					heapq.heapreplace(best, (-d, id(entity), entity))
+
+		for r in range(max_ring + 1):
+			if (2 * r + 1) ** 2 > len(self.cells):
+				# the next ring costs more than the occupied cells left, walk those
+				for (kx, ky), entries in self.cells.items():
+					if max(abs(kx - cx), abs(ky - cy)) >= r:
+						offer(entries)
+				break
+			for key in self.ring(cx, cy, r):
+				offer(self.cells.get(key, []))
+			# cells past ring r are at least r cells away
+			if len(best) == k and -best[0][0] <= (r * self.cell_size) ** 2:
+				break
+		return [(math.sqrt(-d), entity) for d, _, entity in sorted(best, reverse=True)]
+
+
+def build_index(
+	path: str, jobs: int = 1, cell_size: float = chunk_size
+) -> SpatialIndex:
+	# entities are added as each file finishes parsing
+	index = SpatialIndex(cell_size)
+	index.extend(parse_files(entity_files(path), jobs))
+	return index
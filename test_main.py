@@ -0,0 +1,96 @@
+import pytest
+
+import bench
+import config
+import main
+
+
+@pytest.fixture
+def bench_file(tmp_path, monkeypatch) -> str:
+	# a synthetic entities file, its schema and cache kept out of the real folders
+	directory = str(tmp_path) + "/"
+	monkeypatch.setattr(config, "schema_path", directory)
+	monkeypatch.setattr(config, "cache_path", directory)
+	bench.write_bench_schema(directory)
+	entities = bench.generate(50, 3, 4, 2, bench.parse_mix(bench.default_mix), 1, 4)
+	file = directory + "entities_0.bin"
+	open(file, "wb").write(main.compress(main.save(entities, bench.bench_hash)))
+	return file
+
+
+# escapes, non-ascii, both quotes and a byte that is not valid utf-8
+odd_strings = ["line1\nline2 C:\\mods \u00e9 \"'", "\udcff raw"]
+
+
+def decompressed(file: str) -> bytes:
+	return bytes(main.decompress(open(file, "rb").read()))
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_save_parse_roundtrip(bench_file, lazy):
+	entities = main.parse_data(open(bench_file, "rb").read(), lazy)
+	assert main.save(entities, bench.bench_hash) == decompressed(bench_file)
+
+
+def test_rewrite_file(bench_file, tmp_path):
+	out_file = str(tmp_path / "rewritten.bin")
+	main.rewrite_file(bench_file, out_file)
+	assert decompressed(out_file) == decompressed(bench_file)
+
+
+def test_patch_file(bench_file, tmp_path):
+	before = [entity for entity, _ in main.flatten_entities(main.parse_file(bench_file))]
+	target = next(
+		i
+		for i, entity in enumerate(before)
+		if any(c.name == "ScalarComponent" for c in entity.components)
+	)
+
+	def edit(patcher: main.EntityPatcher):
+		# a string changes size and is spliced, a float is packed in place
+		patcher.set_field(target, "ScalarComponent", "name", "patched name")
+		patcher.set_field(target, "ScalarComponent", "speed", 1.5)
+		patcher.set_transform(target, x=100.0, y=-200.0)
+
+	out_file = str(tmp_path / "patched.bin")
+	main.patch_file(bench_file, out_file, edit)
+	after = [entity for entity, _ in main.flatten_entities(main.parse_file(out_file))]
+	assert len(after) == len(before)
+	for i, (old, new) in enumerate(zip(before, after)):
+		if i != target:
+			assert new == old
+			continue
+		component = next(c for c in new.components if c.name == "ScalarComponent")
+		assert component.fields["name"] == "patched name"
+		assert component.fields["speed"] == 1.5
+		assert (new.x, new.y) == (100.0, -200.0)
+		old.x, old.y = new.x, new.y
+		old_component = next(c for c in old.components if c.name == "ScalarComponent")
+		old_component.fields.update(name="patched name", speed=1.5)
+		assert new == old
+
+
+def test_odd_strings_roundtrip(tmp_path, monkeypatch):
+	directory = str(tmp_path) + "/"
+	monkeypatch.setattr(config, "schema_path", directory)
+	monkeypatch.setattr(config, "cache_path", directory)
+	bench.write_bench_schema(directory)
+	entities = bench.generate(2, 1, 1, 0, bench.parse_mix("ScalarComponent"))
+	for entity, string in zip(entities, odd_strings):
+		entity.path = string
+		entity.components[0].fields["name"] = string
+	file = directory + "entities_0.bin"
+	main.save_file(file, entities, bench.bench_hash)
+	payload = decompressed(file)
+	main.rewrite_file(file, file)
+	main.rewrite_file(file, file)
+	assert decompressed(file) == payload
+	parsed = main.parse_file(file)
+	assert [e.path for e in parsed] == odd_strings
+	assert [e.components[0].fields["name"] for e in parsed] == odd_strings
+
+	def edit(patcher: main.EntityPatcher):
+		patcher.set_field(0, 0, "name", odd_strings[1])
+
+	main.patch_file(file, file, edit)
+	assert main.parse_file(file)[0].components[0].fields["name"] == odd_strings[1]